@@ -0,0 +1,260 @@
+"""
+Нагрузочный прогон бота без настоящего Telegram.
+
+Поднимает заглушку Bot API на aiohttp (задержка и ответы 429 настраиваются), подключает к ней bot.py
+и локальный Postgres и прогоняет через диспетчер тысячи виртуальных пользователей: регистрация,
+кнопки расписания и информации о курсе, затем рассылка (вместе с нажатиями кнопок) и напоминание.
+
+Запускать только на тестовой базе — пользователи бенчмарка создаются в ней и удаляются после прогона:
+    DATABASE_URL=postgresql://localhost/biblybot_bench python benchmark.py --users 2000
+"""
+import argparse
+import asyncio
+import importlib
+import itertools
+import json
+import logging
+import os
+import random
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+
+import pytz
+from aiohttp import web
+
+# Пользователи бенчмарка получают id из отдельного диапазона и удаляются после прогона
+USER_ID_BASE = 9_000_000_000
+BENCH_ADMIN_ID = 8_999_999_999
+BENCH_TOKEN = "123456:benchmark"
+
+COUNTRIES = ["Казахстан", "Кыргызстан", "Узбекистан", "Россия", "Германия", "Корея"]
+BUTTONS = ["📅 Расписание", "ℹ️ Информация о курсе", "Назад"]
+
+
+class FakeTelegram:
+    """Заглушка Bot API: отвечает с задержкой и с вероятностью `flood_rate` возвращает 429."""
+
+    def __init__(self, latency, flood_rate, retry_after):
+        self.latency = latency
+        self.flood_rate = flood_rate
+        self.retry_after = retry_after
+        self.calls = Counter()
+        self.flooded = 0
+        self._message_ids = itertools.count(1)
+
+    def sent(self):
+        """Сколько сообщений доставлено (успешные send*/copy*)."""
+        return sum(count for method, count in self.calls.items() if method.startswith(("send", "copy")))
+
+    def _message(self, chat_id, text=None):
+        return {"message_id": next(self._message_ids), "date": int(time.time()),
+                "chat": {"id": int(chat_id), "type": "private"}, "text": text or ""}
+
+    async def handle(self, request):
+        method = request.match_info["method"].lower()
+        params = await request.post()
+        await asyncio.sleep(self.latency * random.uniform(0.5, 1.5))
+
+        if method.startswith(("send", "copy")) and random.random() < self.flood_rate:
+            self.flooded += 1
+            return web.json_response({
+                "ok": False, "error_code": 429,
+                "description": f"Too Many Requests: retry after {self.retry_after}",
+                "parameters": {"retry_after": self.retry_after},
+            })
+
+        self.calls[method] += 1
+        chat_id = params.get("chat_id", 0)
+        if method == "getme":
+            result = {"id": 1, "is_bot": True, "first_name": "Benchmark"}
+        elif method == "copymessage":
+            result = {"message_id": next(self._message_ids)}
+        elif method == "copymessages":
+            result = [{"message_id": next(self._message_ids)} for _ in json.loads(params["message_ids"])]
+        elif method == "sendmediagroup":
+            result = [self._message(chat_id) for _ in json.loads(params["media"])]
+        elif method.startswith(("send", "edit")):
+            result = self._message(chat_id, params.get("text"))
+        else:
+            result = True
+        return web.json_response({"ok": True, "result": result})
+
+    async def start(self, host, port):
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self.handle)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        await web.TCPSite(runner, host, port).start()
+        return runner
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def format_latencies(values):
+    return (f"{len(values)} обновлений, p50 {percentile(values, 0.5) * 1000:.0f} мс, "
+            f"p99 {percentile(values, 0.99) * 1000:.0f} мс")
+
+
+class Simulator:
+    """Прогоняет обновления виртуальных пользователей через диспетчер bot.py."""
+
+    def __init__(self, bot_module, think_time):
+        self.bot_module = bot_module
+        self.think_time = think_time
+        self.errors = 0
+        self._update_ids = itertools.count(1)
+
+    async def feed(self, user_id, text, latencies):
+        from aiogram.types import Update
+
+        update_id = next(self._update_ids)
+        update = Update.model_validate({
+            "update_id": update_id,
+            "message": {
+                "message_id": update_id, "date": int(time.time()), "text": text,
+                "chat": {"id": user_id, "type": "private"},
+                "from": {"id": user_id, "is_bot": False, "first_name": "Benchmark"},
+            },
+        }, context={"bot": self.bot_module.bot})
+
+        started = time.perf_counter()
+        try:
+            await self.bot_module.dp.feed_update(self.bot_module.bot, update)
+        except Exception as e:
+            self.errors += 1
+            logging.debug(f"Ошибка обработки обновления {user_id}: {e}")
+        latencies.append(time.perf_counter() - started)
+
+    async def pause(self):
+        await asyncio.sleep(self.think_time * random.uniform(0.5, 1.5))
+
+    async def registration(self, index, ramp, latencies):
+        """Один пользователь: /start, регистрация и несколько нажатий кнопок."""
+        user_id = USER_ID_BASE + index
+        await asyncio.sleep(random.uniform(0, ramp))
+        steps = ["/start", "📝 Зарегистрироваться", f"Пользователь {index}", random.choice(COUNTRIES),
+                 "01.02.1990", "+77001234567", *random.sample(BUTTONS, len(BUTTONS))]
+        for text in steps:
+            await self.feed(user_id, text, latencies)
+            await self.pause()
+
+    async def taps(self, users, duration, latencies):
+        """Случайные нажатия кнопок зарегистрированными пользователями в течение `duration` секунд."""
+        deadline = time.monotonic() + duration
+
+        async def user_loop(index):
+            while time.monotonic() < deadline:
+                await self.pause()
+                await self.feed(USER_ID_BASE + index, random.choice(BUTTONS), latencies)
+
+        await asyncio.gather(*(user_loop(index) for index in users))
+
+
+async def cleanup(pool, job_id):
+    async with pool.acquire() as conn:
+        await conn.execute("DELETE FROM users WHERE user_id >= $1", USER_ID_BASE)
+        await conn.execute("DELETE FROM fsm_storage WHERE user_id >= $1", USER_ID_BASE)
+        await conn.execute("DELETE FROM reminder_deliveries WHERE user_id >= $1", USER_ID_BASE)
+        if job_id:
+            await conn.execute("DELETE FROM broadcast_jobs WHERE id = $1", job_id)
+
+
+async def run(args):
+    fake = FakeTelegram(args.api_latency, args.flood_rate, args.retry_after)
+    runner = await fake.start("127.0.0.1", args.port)
+
+    # bot.py читает настройки при импорте, поэтому окружение задаётся до него
+    os.environ["TELEGRAM_API_URL"] = f"http://127.0.0.1:{args.port}"
+    os.environ["BOT_TOKEN"] = BENCH_TOKEN
+    os.environ["ADMIN_ID"] = str(BENCH_ADMIN_ID)
+    if args.rate:
+        os.environ["OUTBOUND_RATE"] = str(args.rate)
+    bot_module = importlib.import_module("bot")
+    metrics = bot_module.metrics
+    logging.getLogger().setLevel(logging.WARNING)
+
+    pool = await bot_module.create_db_pool()
+    if pool is None:
+        raise SystemExit("Нет подключения к базе данных (DATABASE_URL).")
+    bot_module.db_pool = pool
+    await bot_module.init_db(pool)
+    bot_module.fsm_storage.pool = pool
+    await bot_module.registered_users.warm(pool)
+    await bot_module.content_store.refresh()
+    await bot_module.schedule_cache.start(pool)
+
+    simulator = Simulator(bot_module, args.think_time)
+    job_id = None
+    report = []
+    try:
+        # 1. Регистрация и кнопки
+        latencies = []
+        sent_before, started = fake.sent(), time.perf_counter()
+        await asyncio.gather(*(simulator.registration(index, args.ramp, latencies) for index in range(args.users)))
+        elapsed = time.perf_counter() - started
+        report.append(f"Регистрация ({args.users} польз., {elapsed:.1f} с): {format_latencies(latencies)}, "
+                      f"{(fake.sent() - sent_before) / elapsed:.1f} сообщ./с")
+
+        # 2. Рассылка всем и одновременно нажатия кнопок: ответы не должны ждать рассылку
+        # Заглушка не хранит сообщения, поэтому «копируется» несуществующее сообщение администратора
+        payload = {"source_chat_id": BENCH_ADMIN_ID, "message_ids": [1]}
+        job_id = await bot_module.create_job(pool, payload, BENCH_ADMIN_ID)
+        latencies = []
+        sent_before, started = fake.sent(), time.perf_counter()
+        broadcast = asyncio.create_task(bot_module.run_broadcast(job_id, BENCH_ADMIN_ID))
+        tappers = random.sample(range(args.users), min(args.tappers, args.users))
+        await simulator.taps(tappers, args.tap_duration, latencies)
+        await broadcast
+        elapsed = time.perf_counter() - started
+        recipients = sum((await bot_module.repository.job_delivery_counts(pool, job_id)).values())
+        report.append(f"Рассылка ({recipients} получателей, {elapsed:.1f} с): "
+                      f"{(fake.sent() - sent_before) / elapsed:.1f} сообщ./с")
+        report.append(f"Кнопки во время рассылки: {format_latencies(latencies)}")
+
+        # 3. Напоминание подписчикам первого курса (уникальный момент занятия, чтобы не мешал журнал)
+        schedule_id = min(bot_module.schedule_cache.rows, default=None)
+        if schedule_id is not None:
+            lesson_at = datetime.now(pytz.utc) + timedelta(hours=1, microseconds=random.randrange(10 ** 6))
+            sent_before, started = fake.sent(), time.perf_counter()
+            await bot_module.send_reminders(schedule_id, bot_module.REMIND_HOUR_BEFORE, lesson_at)
+            elapsed = time.perf_counter() - started
+            reminded = fake.sent() - sent_before
+            report.append(f"Напоминание ({reminded} сообщ., {elapsed:.1f} с): {reminded / elapsed:.1f} сообщ./с")
+    finally:
+        await cleanup(pool, job_id)
+        await bot_module.schedule_cache.stop()
+        await pool.close()
+        await bot_module.bot.session.close()
+        await runner.cleanup()
+
+    report.append(f"Ошибок в хендлерах: {simulator.errors}; ответов 429 от заглушки: {fake.flooded}")
+    report.append(f"Ожидание пула БД: p50 ≤ {metrics.POOL_WAIT.quantile(0.5) or 0:.3f} с, "
+                  f"p99 ≤ {metrics.POOL_WAIT.quantile(0.99) or 0:.3f} с")
+    print("\n".join(report))
+    print()
+    print(metrics.stats_report())
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Нагрузочный прогон бота против заглушки Bot API.")
+    parser.add_argument("--users", type=int, default=1000, help="виртуальных пользователей")
+    parser.add_argument("--ramp", type=float, default=10.0, help="за сколько секунд подключаются все пользователи")
+    parser.add_argument("--think-time", type=float, default=1.0, help="средняя пауза между действиями, с")
+    parser.add_argument("--tappers", type=int, default=200, help="сколько пользователей жмут кнопки во время рассылки")
+    parser.add_argument("--tap-duration", type=float, default=10.0, help="сколько секунд жмут кнопки во время рассылки")
+    parser.add_argument("--api-latency", type=float, default=0.05, help="средняя задержка ответа Bot API, с")
+    parser.add_argument("--flood-rate", type=float, default=0.0, help="доля вызовов, на которые приходит 429")
+    parser.add_argument("--retry-after", type=int, default=1, help="retry_after в ответах 429, с")
+    parser.add_argument("--rate", type=float, help="лимит исходящих сообщений в секунду (OUTBOUND_RATE)")
+    parser.add_argument("--port", type=int, default=8081, help="порт заглушки Bot API")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    asyncio.run(run(parse_args()))
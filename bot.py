@@ -1,22 +1,39 @@
+import time
+
+_import_started = time.perf_counter()  # Для отчёта о времени запуска
+
 import asyncio
 import logging
 import os
-import asyncpg
 import re
 from aiogram import Bot, Dispatcher, types, Router, F
-from aiogram.types import ReplyKeyboardMarkup, KeyboardButton
+from aiogram.types import ReplyKeyboardMarkup, KeyboardButton, InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import StatesGroup, State
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
+import pytz
 from dotenv import load_dotenv
 from models import init_db
-import pandas as pd  # Добавляем импорт pandas
-from io import BytesIO  # Для отправки файла без сохранения на диск
-from datetime import datetime, timedelta
-import pytz  # Для работы с часовыми поясами
-from timezonefinder import TimezoneFinder
-
-tf = TimezoneFinder()
+import repository
+from fsm_storage import PostgresStorage
+from cache import RegisteredUsers, ScheduleCache, INACTIVE_REFRESH_INTERVAL
+from content import ContentStore, CONTENT_CHECK_INTERVAL
+from export import export_students, export_deliveries, parse_export_args, EXPORT_USAGE
+from importer import import_users, IMPORT_USAGE
+from search import search_users, format_results, results_keyboard, parse_callback
+from reminders import ReminderPlanner, parse_timezone, REMIND_HOUR_BEFORE
+from timezones import timezone_for_country, timezone_for_location
+from webhook import run_webhook, polling_on_web_dyno, WEBHOOK_URL, WEBAPP_HOST
+import metrics
+import outbound
+from throttling import ThrottlingMiddleware, register_before_fsm
+from broadcast import (fan_out, deactivate_unreachable, create_job, run_job, payload_from_messages,
+                       local_time_waves, claim_orphaned_jobs, renew_job_leases, on_deactivate, BroadcastProgress,
+                       JOB_HEARTBEAT_INTERVAL, SENT, INACTIVE)
+from contextlib import contextmanager
+from datetime import datetime
 
 # Загрузка переменных окружения
 load_dotenv()
@@ -24,87 +41,104 @@ TOKEN = os.getenv("BOT_TOKEN")
 DATABASE_URL = os.getenv("DATABASE_URL")
 SUPPORT_USERNAME = os.getenv("SUPPORT_USERNAME")
 ADMIN_ID = int(os.getenv("ADMIN_ID"))  # ID администратора
-
-bot = Bot(token=TOKEN)
-dp = Dispatcher()
+# Адрес Bot API: собственный telegram-bot-api сервер или заглушка из benchmark.py
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL")
+
+session = AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_URL)) if TELEGRAM_API_URL else None
+bot = Bot(token=TOKEN, session=session)
+# Все исходящие вызовы проходят через общую очередь с приоритетами (см. outbound.py);
+# middleware метрик подключён внутри неё и замеряет только сам вызов Bot API
+bot.session.middleware(outbound.dispatcher)
+bot.session.middleware(metrics.TelegramMetricsMiddleware())
+fsm_storage = PostgresStorage()  # Состояния диалогов хранятся в БД и переживают рестарт
+dp = Dispatcher(storage=fsm_storage)
 router = Router()
 dp.include_router(router)
+router.message.middleware(metrics.MetricsMiddleware())
+router.callback_query.middleware(metrics.MetricsMiddleware())
+# Ограничение частоты обновлений от одного пользователя (администратор не ограничивается);
+# стоит до чтения FSM-состояния, чтобы отброшенные обновления не ходили в БД
+register_before_fsm(dp, ThrottlingMiddleware(exempt={ADMIN_ID}))
 logging.basicConfig(level=logging.INFO)
 
+# Длительность этапов запуска: (название, секунды)
+startup_timings = [("импорт", time.perf_counter() - _import_started)]
+
+
+@contextmanager
+def startup_phase(name):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        startup_timings.append((name, time.perf_counter() - started))
+
+
+def log_startup_timings():
+    total = sum(seconds for _, seconds in startup_timings)
+    phases = ", ".join(f"{name} {seconds:.2f} с" for name, seconds in startup_timings)
+    logging.info(f"Бот запущен за {total:.2f} с: {phases}")
+
 
 # Подключение к базе данных
 async def create_db_pool():
     """Создаёт пул подключений к БД с обработкой ошибок."""
     try:
-        return await asyncpg.create_pool(DATABASE_URL)
+        return await repository.create_pool(DATABASE_URL)
     except Exception as e:
         logging.error(f"Ошибка подключения к базе данных: {e}")
         return None
 
 
-async def send_reminders():
-    async with db_pool.acquire() as conn:
-        schedule = await conn.fetchrow("SELECT * FROM schedule")
-        if not schedule:
-            return  # Если расписания нет, ничего не делаем
-
-        schedule_timezone = pytz.timezone(schedule["timezone"])
-        lesson_time_utc = datetime.strptime(schedule["time"], "%H:%M").time()
-        lesson_datetime_utc = schedule_timezone.localize(datetime.combine(datetime.now().date(), lesson_time_utc))
-
-        reminder_1h_utc = lesson_datetime_utc - timedelta(hours=1)
-        reminder_1d_utc = lesson_datetime_utc - timedelta(days=1)
-
-        # Русские дни переводим в английские
-        DAYS_MAP = {
-            "пн": "mon", "вт": "tue", "ср": "wed", "чт": "thu",
-            "пт": "fri", "сб": "sat", "вс": "sun"
-        }
-        lesson_days = [DAYS_MAP[day.strip().lower()] for day in schedule["days"].split(",")]
-
-        now_utc = datetime.now(pytz.utc)
+async def send_reminders(schedule_id, kind, lesson_at):
+    """Рассылает подписчикам курса напоминание о занятии, которое начнётся в lesson_at (UTC)."""
+    # Получатели отмечаются в журнале до отправки, поэтому повторный вызов (после перезапуска
+    # или на другом инстансе) никого не найдёт. Они сгруппированы по часовому поясу: текст собирается один раз на пояс
+    buckets = await repository.claim_reminder_recipients(db_pool, schedule_id, lesson_at, kind)
 
-        users = await conn.fetch("SELECT user_id, timezone FROM users")  # Получаем таймзоны пользователей
-
-        for user in users:
-            user_tz = pytz.timezone(user["timezone"]) if user["timezone"] else pytz.utc
-            user_time = lesson_datetime_utc.astimezone(user_tz).strftime(
-                "%H:%M")  # Конвертируем в локальное время пользователя
-
-            if now_utc.strftime("%a").lower() in lesson_days:
-                if reminder_1h_utc <= now_utc < lesson_datetime_utc:
-                    await send_reminder(user["user_id"],
-                                        f"📢 Не забудьте! Сегодня в {user_time} (по вашему времени) начнётся занятие по курсу изучения Библии.")
-
-                if reminder_1d_utc.date() == now_utc.date():
-                    await send_reminder(user["user_id"],
-                                        f"📢 Не забудьте! Завтра в {user_time} (по вашему времени) начнётся занятие по курсу изучения Библии.")
+    day_word = "Сегодня" if kind == REMIND_HOUR_BEFORE else "Завтра"
+    sends = []
+    for timezone, user_ids in buckets:
+        # Получатели уже отмечены в журнале: из-за неизвестного пояса они не должны остаться без напоминания
+        try:
+            tz = parse_timezone(timezone)
+        except pytz.UnknownTimeZoneError:
+            logging.warning(f"Неизвестный часовой пояс {timezone!r}, время в напоминании указано по UTC")
+            tz = pytz.utc
+        local_time = lesson_at.astimezone(tz).strftime("%H:%M")
+        text = f"📢 Не забудьте! {day_word} в {local_time} (по вашему времени) начнётся занятие по курсу изучения Библии."
+        sends.append(send_reminder(user_ids, text))
+    await asyncio.gather(*sends)
 
 
-async def send_reminder(users, text):
+async def send_reminder(user_ids, text):
     """Отправляет напоминание всем пользователям."""
-    for user in users:
-        try:
-            await bot.send_message(user["user_id"], text)
-        except Exception as e:
-            logging.warning(f"Ошибка отправки напоминания {user['user_id']}: {e}")
+    results = await fan_out(user_ids, lambda chat_id: bot.send_message(chat_id, text), priority=outbound.REMINDER)
+    await deactivate_unreachable(db_pool, results)
 
 
-async def notify_schedule_update():
-    async with db_pool.acquire() as conn:
-        users = await conn.fetch("SELECT user_id FROM users")
+async def notify_schedule_update(schedule_id):
+    user_ids = await repository.subscriber_ids(db_pool, schedule_id)
 
-        for user in users:
-            try:
-                await bot.send_message(user["user_id"],
-                                       "📢 Внимание! Расписание занятий изменилось. Проверьте новое расписание в боте. \n "
-                                       "по кнопке 'Расписание'")
-            except Exception as e:
-                logging.warning(f"Ошибка отправки уведомления {user['user_id']}: {e}")
+    text = ("📢 Внимание! Расписание занятий изменилось. Проверьте новое расписание в боте. \n "
+            "по кнопке 'Расписание'")
+    results = await fan_out(user_ids, lambda chat_id: bot.send_message(chat_id, text), priority=outbound.REMINDER)
+    await deactivate_unreachable(db_pool, results)
 
 
 db_pool = None
 scheduler = AsyncIOScheduler()
+reminder_planner = ReminderPlanner()
+registered_users = RegisteredUsers()
+on_deactivate(registered_users.mark_inactive)
+schedule_cache = ScheduleCache()
+content_store = ContentStore()
+background_tasks = set()
+# Части альбома, собираемые для рассылки: {media_group_id: [сообщения]}
+media_groups = {}
+ALBUM_COLLECT_SECONDS = 1.0
+# Сколько волн рассылки по местному времени ещё не отправлено: {job_id: число волн}
+local_waves_left = {}
 
 
 # Определение состояний
@@ -116,6 +150,7 @@ class Registration(StatesGroup):
 
 
 class EditSchedule(StatesGroup):
+    course = State()
     text = State()
     days = State()
     time = State()
@@ -124,12 +159,23 @@ class EditSchedule(StatesGroup):
 
 class Broadcast(StatesGroup):
     text = State()
+    send_at = State()
 
 
 class SearchUser(StatesGroup):
     query = State()
 
 
+class ImportUsers(StatesGroup):
+    file = State()
+
+
+# Кнопки с ответами из текстовых файлов (см. content.CONTENT_FILES): текст кнопки -> ключ
+FAQ_BUTTONS = {
+    "Информация об организации": "organization",
+    "❓ Частые вопросы": "faq",
+}
+
 # Клавиатуры
 unregistered_keyboard = ReplyKeyboardMarkup(
     keyboard=[
@@ -143,6 +189,7 @@ question_keyboard = ReplyKeyboardMarkup(
         [KeyboardButton(text="Курс бесплатный?")],
         [KeyboardButton(text="Можно ли смотреть запись урока?")],
         [KeyboardButton(text="Информация об организации")],
+        [KeyboardButton(text="❓ Частые вопросы")],
         [KeyboardButton(text="Назад")]
     ],
     resize_keyboard=True
@@ -151,11 +198,27 @@ after_registration_keyboard = ReplyKeyboardMarkup(
     keyboard=[
         [KeyboardButton(text="ℹ️ Информация о курсе")],
         [KeyboardButton(text="📅 Расписание")],
+        [KeyboardButton(text="📚 Мои курсы")],
         [KeyboardButton(text="📞 Связь с оператором")]
     ],
     resize_keyboard=True
 )
 
+location_keyboard = ReplyKeyboardMarkup(
+    keyboard=[
+        [KeyboardButton(text="📍 Отправить местоположение", request_location=True)]
+    ],
+    resize_keyboard=True,
+    one_time_keyboard=True
+)
+
+SEND_NOW = "🚀 Отправить сейчас"
+send_now_keyboard = ReplyKeyboardMarkup(
+    keyboard=[[KeyboardButton(text=SEND_NOW)]],
+    resize_keyboard=True,
+    one_time_keyboard=True
+)
+
 admin_keyboard = ReplyKeyboardMarkup(
     keyboard=[
         [KeyboardButton(text="✏️ Редактировать расписание")],
@@ -180,28 +243,83 @@ async def add_test_users(message: types.Message):
         (105, 'Дмитрий Кузнецов', 'Екатеринбург', 35, '+79591234561'),
     ]
 
-    async with db_pool.acquire() as conn:
-        for user in test_users:
-            user_id = int(user[0])  # Явно преобразуем user_id в число
-            await conn.execute(
-                "INSERT INTO users (user_id, full_name, country, age, phone) "
-                "VALUES ($1, $2, $3, $4, $5) "
-                "ON CONFLICT (user_id) DO NOTHING",
-                user_id, *user[1:]
-            )
+    await repository.insert_users_if_missing(db_pool, test_users)
+    for user in test_users:
+        registered_users.add(user[0])
 
     await message.answer("✅ Тестовые пользователи добавлены!")
 
 
+@router.message(F.text == "/import")
+async def start_import(message: types.Message, state: FSMContext):
+    if message.from_user.id != ADMIN_ID:
+        return
+    await message.answer(f"{IMPORT_USAGE}\nДля отмены отправьте /cancel.")
+    await state.set_state(ImportUsers.file)
+
+
+@router.message(ImportUsers.file, F.document)
+async def process_import(message: types.Message, state: FSMContext):
+    await state.clear()
+    file = await bot.download(message.document)
+
+    try:
+        inserted_ids, duplicates, invalid = await import_users(db_pool, file.read(), message.document.file_name or "")
+    except ValueError as e:
+        await message.answer(f"Ошибка! {e}\n{IMPORT_USAGE}")
+        return
+
+    for user_id in inserted_ids:
+        registered_users.add(user_id)
+
+    await message.answer(
+        "✅ Импорт завершён!\n"
+        f"Добавлено: {len(inserted_ids)}\n"
+        f"Уже были в базе (дубликаты): {duplicates}\n"
+        f"Некорректных строк: {invalid}"
+    )
+
+
+@router.message(F.text == "/backfill_timezones")
+async def backfill_timezones(message: types.Message):
+    if message.from_user.id != ADMIN_ID:
+        return
+
+    users = await repository.users_without_timezone(db_pool)
+    resolved = [(user["user_id"], timezone_for_country(user["country"])) for user in users]
+    resolved = [(user_id, timezone) for user_id, timezone in resolved if timezone]
+    if resolved:
+        await repository.update_timezones(db_pool, [user_id for user_id, _ in resolved],
+                                          [timezone for _, timezone in resolved])
+
+    await message.answer(f"✅ Часовой пояс определён для {len(resolved)} из {len(users)} пользователей.")
+
+
 @router.message(F.text == "/clear_db")
 async def clear_database(message: types.Message):
     if message.from_user.id != ADMIN_ID:
         return
 
-    async with db_pool.acquire() as conn:
-        await conn.execute("DELETE FROM users;")
-        await conn.execute("DELETE FROM schedule;")
-        await message.answer("✅ База данных очищена!")
+    await repository.clear_users_and_schedule(db_pool)
+    await schedule_cache.invalidate()
+    registered_users.clear()
+    await message.answer("✅ База данных очищена!")
+
+
+@router.message(F.text == "/reload_content")
+async def reload_content(message: types.Message):
+    if message.from_user.id != ADMIN_ID:
+        return
+
+    changed = await content_store.refresh(force=True)
+    await message.answer(f"✅ Тексты перезагружены: {', '.join(changed)}")
+
+
+@router.message(F.text == "/stats")
+async def show_stats(message: types.Message):
+    if message.from_user.id != ADMIN_ID:
+        return
+    await message.answer(metrics.stats_report(db_pool))
 
 
 @router.message(F.text == "/start")
@@ -210,10 +328,10 @@ async def start_command(message: types.Message):
         await message.answer("Добро пожаловать, Админ!", reply_markup=admin_keyboard)
         return
 
-    async with db_pool.acquire() as conn:
-        user = await conn.fetchrow("SELECT * FROM users WHERE user_id = $1", message.from_user.id)
-
-    if user:
+    if await registered_users.is_registered(message.from_user.id):
+        # Пользователь снова написал боту — значит, рассылки до него опять доходят
+        if await registered_users.reactivate(message.from_user.id):
+            logging.info(f"Пользователь {message.from_user.id} снова активен")
         await message.answer(
             "Добро пожаловать обратно! Чем могу помочь?",
             reply_markup=after_registration_keyboard
@@ -238,18 +356,13 @@ async def quit_command(message: types.Message):
     await message.answer("Да, для этого свяжитесь с оператором( Доступен после регистрации )")
 
 
-@router.message(F.text == "Информация об организации")
+@router.message(F.text.in_(FAQ_BUTTONS))
 async def quit_command(message: types.Message):
-    with open("question_3.txt", "r", encoding="UTF8") as f:
-        quit_text = f.read()
-    await message.answer(quit_text)
+    await message.answer(content_store.get(FAQ_BUTTONS[message.text]))
 
 @router.message(F.text == "Назад")
 async def quit_command(message: types.Message):
-    async with db_pool.acquire() as conn:
-        user = await conn.fetchrow("SELECT * FROM users WHERE user_id = $1", message.from_user.id)
-
-    if user:
+    if await registered_users.is_registered(message.from_user.id):
         # Если пользователь зарегистрирован, возвращаем клавиатуру с расписанием и оператором
         keyboard = after_registration_keyboard
         await message.answer("Если у вас ещё остались вопросы, свяжитесь с оператором", reply_markup=keyboard)
@@ -273,14 +386,25 @@ async def start_registration(message: types.Message, state: FSMContext):
 async def process_full_name(message: types.Message, state: FSMContext):
     await state.update_data(full_name=message.text)
     await message.answer(
-        "Спасибо! Напишите, пожалуйста, вашу страну, чтобы мы могли правильно определить время занятий.",
-        reply_markup=types.ReplyKeyboardRemove())
+        "Спасибо! Напишите, пожалуйста, вашу страну, чтобы мы могли правильно определить время занятий.\n"
+        "Можно также отправить местоположение кнопкой ниже.",
+        reply_markup=location_keyboard)
     await state.set_state(Registration.country)
 
 
+@router.message(Registration.country, F.location)
+async def process_location(message: types.Message, state: FSMContext):
+    timezone = await timezone_for_location(message.location.latitude, message.location.longitude)
+    await state.update_data(timezone=timezone)
+    await message.answer("Спасибо! Теперь напишите, пожалуйста, вашу страну.",
+                         reply_markup=types.ReplyKeyboardRemove())
+
+
 @router.message(Registration.country)
 async def process_city(message: types.Message, state: FSMContext):
-    await state.update_data(country=message.text)
+    data = await state.update_data(country=message.text)
+    if not data.get("timezone"):
+        await state.update_data(timezone=timezone_for_country(message.text))
     await message.answer("🙏☺️ Осталось всего пару вопросов, и вы будете зарегистрированы.\n"
                          "Напишите, пожалуйста, вашу дату рождения формат: ДД:ММ:ГГ (пример: 01.02.1970).",
                          reply_markup=types.ReplyKeyboardRemove())
@@ -333,11 +457,9 @@ async def process_phone(message: types.Message, state: FSMContext):
     await state.update_data(phone=message.text)
     data = await state.get_data()
 
-    async with db_pool.acquire() as conn:
-        await conn.execute("""
-                INSERT INTO users (user_id, full_name, country, age, phone) 
-                VALUES ($1, $2, $3, $4, $5)
-            """, message.from_user.id, data['full_name'], data['country'], data['age'], data['phone'])
+    await repository.insert_user(db_pool, message.from_user.id, data['full_name'], data['country'], data['age'],
+                                 data['phone'], data.get('timezone') or "UTC")
+    registered_users.add(message.from_user.id)
 
     await message.answer(
         "Благодарю за предоставленную информацию! Скоро мы отправим вам расписание курса. 😇",
@@ -356,59 +478,114 @@ async def start_broadcast(message: types.Message, state: FSMContext):
 
 @router.message(Broadcast.text)
 async def process_broadcast(message: types.Message, state: FSMContext):
-    async with db_pool.acquire() as conn:
-        users = await conn.fetch("SELECT user_id, full_name FROM users")
-
-    sent_users = []
-    failed_users = []
-
-    # Проверяем, есть ли медиа в сообщении
-    caption = message.caption if message.caption else message.text
-    media = None
-
-    if message.photo:
-        media = types.InputMediaPhoto(media=message.photo[-1].file_id, caption=caption)
-    elif message.video:
-        media = types.InputMediaVideo(media=message.video.file_id, caption=caption)
-    elif message.document:
-        media = types.InputMediaDocument(media=message.document.file_id, caption=caption)
-    elif message.audio:
-        media = types.InputMediaAudio(media=message.audio.file_id, caption=caption)
-    elif message.voice:
-        media = message.voice.file_id  # Голосовое сообщение
-    elif message.animation:
-        media = message.animation.file_id  # GIF-анимация
-
-    for user in users:
+    messages = [message]
+    if message.media_group_id:
+        # Альбом приходит отдельными сообщениями: первое ждёт остальные, остальные только добавляются к нему
+        album = media_groups.get(message.media_group_id)
+        if album is not None:
+            album.append(message)
+            return
+        messages = media_groups[message.media_group_id] = [message]
+        await asyncio.sleep(ALBUM_COLLECT_SECONDS)
+        del media_groups[message.media_group_id]
+
+    await state.update_data(payload=payload_from_messages(messages))
+    await message.answer("Когда отправить? Нажмите «Отправить сейчас» или введите время ЧЧ:ММ — "
+                         "каждый получатель получит сообщение в это время по своему часовому поясу.",
+                         reply_markup=send_now_keyboard)
+    await state.set_state(Broadcast.send_at)
+
+
+@router.message(Broadcast.send_at)
+async def process_broadcast_time(message: types.Message, state: FSMContext):
+    local_time = None
+    if message.text != SEND_NOW:
         try:
-            if media:
-                if message.voice:
-                    await bot.send_voice(user["user_id"], media, caption=caption)
-                elif message.animation:
-                    await bot.send_animation(user["user_id"], media, caption=caption)
-                else:
-                    await bot.send_media_group(user["user_id"], [media])
-            else:
-                await bot.send_message(user["user_id"], message.text)
-
-            sent_users.append(user["full_name"])
-            await asyncio.sleep(0.1)  # Пауза, чтобы избежать блокировки Telegram
-        except Exception:
-            failed_users.append(user["full_name"])
-
-    # Формируем отчет
-    report = "📢 **Рассылка завершена!**\n"
-    if sent_users:
-        report += "✅ **Сообщение получили:**\n" + "\n".join(sent_users) + "\n"
-    if failed_users:
-        report += "❌ **Не удалось отправить:**\n" + "\n".join(failed_users)
-
-    await message.answer(report)
+            local_time = datetime.strptime(message.text or "", "%H:%M").time()
+        except ValueError:
+            await message.answer("Ошибка! Введите время в формате ЧЧ:ММ (например: 10:00) или нажмите кнопку.")
+            return
+
+    # Рассылка сохраняется в БД, чтобы её можно было продолжить после рестарта
+    payload = (await state.get_data())["payload"]
+    job_id = await create_job(db_pool, payload, message.chat.id, local_time)
     await state.clear()
 
+    if local_time is None:
+        await message.answer("📢 Рассылка запущена.", reply_markup=admin_keyboard)
+        await run_broadcast(job_id, message.chat.id)
+        return
+
+    waves = await schedule_local_broadcast(job_id, message.chat.id, local_time, datetime.now(pytz.utc))
+    if waves:
+        first, last = min(waves), max(waves)
+        await message.answer(f"⏰ Рассылка запланирована на {local_time:%H:%M} по местному времени: "
+                             f"{len(waves)} волн(ы), с {first:%d.%m %H:%M} по {last:%d.%m %H:%M} UTC.",
+                             reply_markup=admin_keyboard)
+    else:
+        await message.answer("❌ Нет получателей для рассылки.", reply_markup=admin_keyboard)
+
+
+async def schedule_local_broadcast(job_id, chat_id, local_time, after):
+    """Ставит в планировщик по задаче на каждую волну рассылки по местному времени; возвращает моменты волн."""
+    waves = local_time_waves(await repository.active_timezones(db_pool), local_time, after)
+    if not waves:
+        await repository.finish_job(db_pool, job_id)
+        return waves
+
+    local_waves_left[job_id] = len(waves)
+    for fire_at, timezones in waves.items():
+        # Пропущенные из-за рестарта волны запускаются сразу
+        scheduler.add_job(run_broadcast_wave, "date", run_date=fire_at, misfire_grace_time=None,
+                          args=[job_id, chat_id, timezones])
+    return waves
+
+
+async def run_broadcast_wave(job_id, chat_id, timezones):
+    """Одна волна рассылки по местному времени; после последней волны отправляет отчёт."""
+    try:
+        await run_job(db_pool, bot, job_id, timezones, finish=False, progress=BroadcastProgress(bot, chat_id, job_id))
+    finally:
+        # Упавшая волна тоже засчитывается, иначе рассылка навсегда осталась бы незавершённой
+        local_waves_left[job_id] -= 1
+        if not local_waves_left[job_id]:
+            del local_waves_left[job_id]
+            await repository.finish_job(db_pool, job_id)
+            await send_broadcast_report(job_id, chat_id)
+
+
+async def run_broadcast(job_id, chat_id):
+    """Выполняет рассылку и отправляет отчёт администратору."""
+    await run_job(db_pool, bot, job_id, progress=BroadcastProgress(bot, chat_id, job_id))
+    await send_broadcast_report(job_id, chat_id)
+
+
+async def send_broadcast_report(job_id, chat_id):
+    """Итог рассылки: только счётчики, результаты по каждому получателю — в приложенном CSV."""
+    counts = await repository.job_delivery_counts(db_pool, job_id)
+    sent, inactive = counts.get(SENT, 0), counts.get(INACTIVE, 0)
+
+    report = (f"📢 Рассылка #{job_id} завершена!\n"
+              f"✅ Доставлено: {sent}\n"
+              f"❌ Не удалось отправить: {sum(counts.values()) - sent - inactive}\n"
+              f"🚫 Заблокировали бота или удалили аккаунт: {inactive}\n"
+              f"💤 Всего неактивных пользователей: {await repository.inactive_users_count(db_pool)}")
+
+    path, count = await export_deliveries(db_pool, job_id)
+    try:
+        if count:
+            await bot.send_document(chat_id, types.FSInputFile(path, filename=f"broadcast_{job_id}.csv"),
+                                    caption=report)
+        else:
+            await bot.send_message(chat_id, report)
+    finally:
+        os.remove(path)
+
 
 @router.message(F.text == "🔍 Поиск пользователя")
 async def start_search(message: types.Message, state: FSMContext):
+    if message.from_user.id != ADMIN_ID:
+        return
     await message.answer("Введите имя или город пользователя для поиска:")
     await state.set_state(SearchUser.query)
 
@@ -416,36 +593,75 @@ async def start_search(message: types.Message, state: FSMContext):
 # ------------------------------------------------------------------------------------------------------------
 @router.message(F.text == "ℹ️ Информация о курсе")
 async def course_info(message: types.Message):
-    async with db_pool.acquire() as conn:
-        user = await conn.fetchrow("SELECT * FROM users WHERE user_id = $1", message.from_user.id)
-
-    with open("question.txt", "r", encoding="utf-8") as f:
-        question_text = f.read()
-
-    await message.answer(question_text, reply_markup=question_keyboard)  # ❗️ Всегда отправляем `question_keyboard`
+    await message.answer(content_store.get("course_info"), reply_markup=question_keyboard)  # ❗️ Всегда отправляем `question_keyboard`
 
 
 # ------------------------------------------------------------------------------------------------------------
 @router.message(F.text == "📅 Расписание")
 async def show_schedule(message: types.Message):
-    async with db_pool.acquire() as conn:
-        user = await conn.fetchrow("SELECT * FROM users WHERE user_id = $1", message.from_user.id)
-        schedule = await conn.fetchrow("SELECT * FROM schedule")
-
-    if not user:
+    if not await registered_users.is_registered(message.from_user.id):
         await message.answer("Вы ещё не зарегистрированы. Пожалуйста, сначала зарегистрируйтесь!",
                              reply_markup=unregistered_keyboard)
         return
 
-    if schedule:
+    if not schedule_cache.rows:
+        await message.answer("❌ Расписание ещё не добавлено.")
+        return
+
+    subscribed = await repository.user_schedule_ids(db_pool, message.from_user.id)
+    schedules = [row for schedule_id, row in schedule_cache.rows.items() if schedule_id in subscribed]
+    if not schedules:
+        await message.answer("Вы не подписаны ни на один курс. Выберите курсы по кнопке «📚 Мои курсы».")
+        return
+
+    for schedule in schedules:
         info_text = (
-            f"📅 **Расписание занятий:**\n{schedule['text']}\n\n"
+            f"📅 **Расписание занятий ({schedule['name']}):**\n{schedule['text']}\n\n"
             f"📆 **Дни недели:** {schedule['days']}\n"
             f"⏰ **Время:** {schedule['time']} ({schedule['timezone']})"
         )
         await message.answer(info_text)
-    else:
-        await message.answer("❌ Расписание ещё не добавлено.")
+
+
+def courses_keyboard(subscribed):
+    """Список курсов; нажатие на курс включает или отключает подписку."""
+    buttons = [
+        [InlineKeyboardButton(text=f"{'✅' if schedule_id in subscribed else '➕'} {row['name']}",
+                              callback_data=f"course:{schedule_id}")]
+        for schedule_id, row in schedule_cache.rows.items()
+    ]
+    return InlineKeyboardMarkup(inline_keyboard=buttons)
+
+
+@router.message(F.text == "📚 Мои курсы")
+async def show_courses(message: types.Message):
+    if not await registered_users.is_registered(message.from_user.id):
+        await message.answer("Вы ещё не зарегистрированы. Пожалуйста, сначала зарегистрируйтесь!",
+                             reply_markup=unregistered_keyboard)
+        return
+    if not schedule_cache.rows:
+        await message.answer("❌ Курсы ещё не добавлены.")
+        return
+
+    subscribed = await repository.user_schedule_ids(db_pool, message.from_user.id)
+    await message.answer("📚 Выберите курсы, о занятиях которых вам напоминать:",
+                         reply_markup=courses_keyboard(subscribed))
+
+
+@router.callback_query(F.data.startswith("course:"))
+async def toggle_course(callback: types.CallbackQuery):
+    schedule_id = int(callback.data.split(":")[1])
+    if schedule_id not in schedule_cache.rows or not await registered_users.is_registered(callback.from_user.id):
+        await callback.answer("Курс не найден.", show_alert=True)
+        return
+
+    subscribed = await repository.user_schedule_ids(db_pool, callback.from_user.id)
+    subscribe = schedule_id not in subscribed
+    await repository.set_subscription(db_pool, callback.from_user.id, schedule_id, subscribe)
+    subscribed ^= {schedule_id}
+
+    await callback.message.edit_reply_markup(reply_markup=courses_keyboard(subscribed))
+    await callback.answer("Вы подписаны на курс." if subscribe else "Подписка на курс отменена.")
 
 
 @router.message(F.text == "📞 Связь с оператором")
@@ -461,49 +677,77 @@ async def support_chat(message: types.Message):
 async def edit_schedule(message: types.Message, state: FSMContext):
     if message.from_user.id != ADMIN_ID:
         return
-    await message.answer("Введите новый текст расписания:")
-    await state.set_state(EditSchedule.text)
+    courses = "\n".join(f"{schedule_id}. {row['name']}" for schedule_id, row in schedule_cache.rows.items())
+    await message.answer(
+        f"Курсы:\n{courses or 'пока нет'}\n\n"
+        "Введите номер курса, расписание которого нужно изменить, или название нового курса:"
+    )
+    await state.set_state(EditSchedule.course)
 
 
 @router.message(F.text == "📋 Показать учеников")
+@router.message(F.text.startswith("/export"))
 async def show_students(message: types.Message):
     if message.from_user.id != ADMIN_ID:
         return
 
-    async with db_pool.acquire() as conn:
-        students = await conn.fetch("SELECT full_name, country, age, phone FROM users")
-
-    if not students:
-        await message.answer("В базе данных пока нет зарегистрированных учеников.")
+    args = message.text.split()[1:] if message.text.startswith("/export") else []
+    try:
+        options = parse_export_args(args)
+    except ValueError as e:
+        await message.answer(f"Ошибка! {e}\n{EXPORT_USAGE}")
         return
 
-    df = pd.DataFrame(students, columns=["ФИО", "Страна", "Д.Рождения", "Телефон"])
-
-    output = BytesIO()
-    with pd.ExcelWriter(output, engine="openpyxl") as writer:
-        df.to_excel(writer, index=False, sheet_name="Ученики")
-
-    output.seek(0)
-    await message.answer_document(types.BufferedInputFile(output.read(), filename="students.xlsx"))
+    path, count = await export_students(db_pool, **options)
+    try:
+        if not count:
+            await message.answer("В базе данных пока нет зарегистрированных учеников.")
+            return
+        await message.answer_document(types.FSInputFile(path, filename=f"students.{options['fmt']}"))
+    finally:
+        os.remove(path)
 
 
 @router.message(SearchUser.query)
 async def process_search(message: types.Message, state: FSMContext):
-    query = message.text.lower()
-    async with db_pool.acquire() as conn:
-        users = await conn.fetch("""
-            SELECT * FROM users 
-            WHERE LOWER(full_name) LIKE '%' || $1 || '%' 
-            OR LOWER(country) LIKE '%' || $1 || '%'
-        """, query)
-
-        if not users:
-            await message.answer("❌ Пользователи не найдены.")
-        else:
-            response = "📋 **Результаты поиска:**\n"
-            for user in users:
-                response += f"👤 {user['full_name']}, 🏙 {user['country']}, {user['age']} возраст\n📞 {user['phone']}\n\n"
-            await message.answer(response)
+    # Запрос сохраняется в данных FSM для листания страниц, само состояние поиска сбрасывается
+    await state.set_state(None)
+    await state.update_data(search_query=message.text)
+
+    users, has_next = await search_users(db_pool, message.text)
+    if not users:
+        await message.answer("❌ Пользователи не найдены.")
+    else:
+        await message.answer(format_results(users), reply_markup=results_keyboard(users, False, has_next))
+
+
+@router.callback_query(F.data.startswith("search:"))
+async def search_page(callback: types.CallbackQuery, state: FSMContext):
+    if callback.from_user.id != ADMIN_ID:
+        await callback.answer()
+        return
+
+    query = (await state.get_data()).get("search_query")
+    if not query:
+        await callback.answer("Поиск устарел, начните новый.", show_alert=True)
+        return
+
+    direction, cursor = parse_callback(callback.data)
+    users, has_more = await search_users(db_pool, query, cursor, direction)
+    if users:
+        has_prev, has_next = (has_more, True) if direction == "prev" else (True, has_more)
+        await callback.message.edit_text(format_results(users), reply_markup=results_keyboard(users, has_prev, has_next))
+    await callback.answer()
+
+
+@router.message(EditSchedule.course)
+async def schedule_course(message: types.Message, state: FSMContext):
+    if message.text.isdigit() and int(message.text) in schedule_cache.rows:
+        await state.update_data(schedule_id=int(message.text), name=None)
+    else:
+        await state.update_data(schedule_id=None, name=message.text.strip())
+    await message.answer("Введите новый текст расписания:")
+    await state.set_state(EditSchedule.text)
 
 
 @router.message(EditSchedule.text)
@@ -545,42 +789,93 @@ async def schedule_timezone(message: types.Message, state: FSMContext):
         return
 
     data = await state.get_data()
-    async with db_pool.acquire() as conn:
-        exists = await conn.fetchrow("SELECT id FROM schedule LIMIT 1")
-        if exists:
-            await conn.execute(
-                "UPDATE schedule SET text = $1, days = $2, time = $3, timezone = $4 WHERE id = $5",
-                data['text'], data['days'], data['time'], message.text, exists['id']
-            )
-        else:
-            await conn.execute(
-                "INSERT INTO schedule (text, days, time, timezone) VALUES ($1, $2, $3, $4)",
-                data['text'], data['days'], data['time'], message.text
-            )
+    schedule_id = await repository.save_schedule(db_pool, data['schedule_id'], data['name'],
+                                                 data['text'], data['days'], data['time'], message.text)
+    await schedule_cache.invalidate()
 
-        await message.answer("✅ Расписание обновлено!", reply_markup=admin_keyboard)
-        await notify_schedule_update()
+    await message.answer("✅ Расписание обновлено!", reply_markup=admin_keyboard)
+    if data['schedule_id']:
+        await notify_schedule_update(schedule_id)
+
+    await state.clear()
 
+
+# Регистрируется после команд и кнопок: иначе в ожидании файла администратор не смог бы ими пользоваться
+@router.message(ImportUsers.file)
+async def import_waiting_file(message: types.Message, state: FSMContext):
+    if message.text == "/cancel":
         await state.clear()
+        await message.answer("Импорт отменён.", reply_markup=admin_keyboard)
+        return
+    await message.answer(f"{IMPORT_USAGE}\nДля отмены отправьте /cancel.")
+
+
+async def resume_broadcasts():
+    """Продолжает рассылки, закреплённые за этим инстансом после истечения аренды прежнего владельца."""
+    for job in await claim_orphaned_jobs(db_pool):
+        logging.info(f"Продолжаем рассылку #{job['id']}")
+        if job["local_time"]:
+            # Волны пересчитываются от исходного момента планирования, уже отправленные получатели пропускаются
+            await schedule_local_broadcast(job["id"], job["admin_chat_id"], job["local_time"], job["scheduled_at"])
+            continue
+        task = asyncio.create_task(run_broadcast(job["id"], job["admin_chat_id"]))
+        background_tasks.add(task)
+        task.add_done_callback(background_tasks.discard)
 
 
 async def main():
     global db_pool
-    db_pool = await create_db_pool()
+    if polling_on_web_dyno():
+        logging.error("WEBHOOK_URL не задан: long polling запускается только на dyno типа worker "
+                      "(heroku ps:scale web=0 worker=1). Бот завершает работу.")
+        return
+
+    with startup_phase("пул БД"):
+        db_pool = await create_db_pool()
 
     if db_pool is None:
         logging.error("Не удалось подключиться к базе данных. Бот завершает работу.")
         return  # Останавливаем бота, если БД недоступна
 
-    await init_db()
-
-    scheduler.start()
-    scheduler.add_job(send_reminders, "cron", hour=9, minute=0)  # Запуск в 9:00 утра
-    scheduler.add_job(send_reminders, "cron", hour=18, minute=30)  # Запуск в 18:30
-
+    with startup_phase("init_db"):
+        await init_db(db_pool)
+    fsm_storage.pool = db_pool
+
+    with startup_phase("кеши"):
+        await registered_users.warm(db_pool)
+        # Тексты загружаются один раз; изменения файлов подхватываются по mtime
+        await content_store.refresh()
+
+    with startup_phase("планировщик"):
+        scheduler.add_job(content_store.refresh, "interval", seconds=CONTENT_CHECK_INTERVAL)
+        scheduler.add_job(registered_users.refresh_inactive, "interval", seconds=INACTIVE_REFRESH_INTERVAL)
+        scheduler.add_job(fsm_storage.cleanup, "interval", hours=1)
+        scheduler.add_job(repository.cleanup_reminder_deliveries, "interval", hours=24, args=[db_pool])
+        scheduler.start()
+
+        # Напоминания приходят точно за сутки и за час до занятия;
+        # очередь перестраивается при каждом изменении расписания (в том числе на других инстансах)
+        schedule_cache.on_change(reminder_planner.rebuild)
+        await schedule_cache.start(db_pool)
+        reminders_task = asyncio.create_task(reminder_planner.run(send_reminders))
+
+    # Продолжаем рассылки, прерванные рестартом
+    await resume_broadcasts()
+    scheduler.add_job(renew_job_leases, "interval", seconds=JOB_HEARTBEAT_INTERVAL, args=[db_pool])
+    scheduler.add_job(resume_broadcasts, "interval", seconds=JOB_HEARTBEAT_INTERVAL)
+
+    log_startup_timings()
     try:
-        await dp.start_polling(bot)
+        if WEBHOOK_URL:
+            await run_webhook(dp, bot, db_pool)
+        else:
+            if metrics.METRICS_PORT:
+                await metrics.start_server(db_pool, WEBAPP_HOST, int(metrics.METRICS_PORT))
+            await bot.delete_webhook()  # На случай, если раньше бот работал через webhook
+            await dp.start_polling(bot)
     finally:
+        reminders_task.cancel()
+        await schedule_cache.stop()
         await db_pool.close()  # Закрываем пул при завершении работ
 
 
@@ -0,0 +1,338 @@
+import asyncio
+import logging
+import os
+import time
+import uuid
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+
+import pytz
+
+from aiogram.exceptions import (
+    TelegramRetryAfter,
+    TelegramForbiddenError,
+    TelegramBadRequest,
+    TelegramNetworkError,
+    TelegramServerError,
+)
+
+import repository
+from metrics import BROADCAST_MESSAGES
+from outbound import lane, BROADCAST
+from reminders import parse_timezone
+
+# Общий лимит ~30 сообщений в секунду на бота соблюдает outbound.dispatcher,
+# здесь — только ~1 сообщение в секунду в один чат
+PER_CHAT_INTERVAL = float(os.getenv("BROADCAST_PER_CHAT_INTERVAL", "1.0"))
+CONCURRENCY = int(os.getenv("BROADCAST_CONCURRENCY", "20"))
+MAX_RETRIES = 3
+
+# Как часто обновляется сообщение администратору с ходом рассылки
+PROGRESS_INTERVAL = float(os.getenv("BROADCAST_PROGRESS_INTERVAL", "5"))
+
+# Рассылку выполняет только инстанс-владелец: он продлевает аренду каждые JOB_HEARTBEAT_INTERVAL секунд,
+# а рассылки с истёкшей арендой (инстанс перезапущен или упал) забирает другой инстанс
+INSTANCE_ID = uuid.uuid4().hex
+JOB_HEARTBEAT_INTERVAL = 30
+JOB_LEASE_SECONDS = float(os.getenv("BROADCAST_LEASE_SECONDS", "120"))
+
+# Статусы доставки пишутся в БД пачками, а не после каждого сообщения
+LEDGER_BATCH_SIZE = 200
+LEDGER_FLUSH_INTERVAL = 2.0
+
+SENT = "sent"
+FAILED = "failed"
+# Чат недоступен навсегда: бот заблокирован, аккаунт удалён или чат не найден
+INACTIVE = "inactive"
+
+# Ошибки BadRequest, после которых писать в чат бессмысленно
+DEAD_CHAT_ERRORS = ("chat not found", "user is deactivated", "peer_id_invalid")
+
+
+class RateLimiter:
+    """Минимальный интервал между сообщениями рассылки в один чат."""
+
+    def __init__(self, per_chat_interval=PER_CHAT_INTERVAL):
+        self.per_chat_interval = per_chat_interval
+        self._chat_next = {}
+
+    async def wait(self, chat_id):
+        now = time.monotonic()
+        next_at = self._chat_next.get(chat_id, 0.0)
+        self._chat_next[chat_id] = max(now, next_at) + self.per_chat_interval
+        if len(self._chat_next) > 10000:
+            self._chat_next = {k: v for k, v in self._chat_next.items() if v > now}
+
+        if next_at > now:
+            await asyncio.sleep(next_at - now)
+
+
+# Общий лимитер для всех рассылок бота
+limiter = RateLimiter()
+
+
+async def deliver(chat_id, send, limiter=limiter):
+    """Отправляет одно сообщение с учётом лимитов и RetryAfter. Возвращает SENT, FAILED или INACTIVE."""
+    for attempt in range(MAX_RETRIES + 1):
+        await limiter.wait(chat_id)
+        try:
+            await send(chat_id)
+            return SENT
+        except TelegramRetryAfter as e:
+            # Очередь исходящих уже приостановлена диспетчером, повтор встанет в неё заново
+            logging.warning(f"Flood control для {chat_id}: ждём {e.retry_after} сек.")
+        except (TelegramNetworkError, TelegramServerError) as e:
+            logging.warning(f"Временная ошибка отправки {chat_id}: {e}")
+            await asyncio.sleep(2 ** attempt)
+        except TelegramForbiddenError as e:
+            logging.info(f"Чат {chat_id} недоступен: {e}")
+            return INACTIVE
+        except TelegramBadRequest as e:
+            if any(error in e.message.lower() for error in DEAD_CHAT_ERRORS):
+                logging.info(f"Чат {chat_id} недоступен: {e}")
+                return INACTIVE
+            logging.warning(f"Не удалось отправить {chat_id}: {e}")
+            return FAILED
+        except Exception as e:
+            logging.warning(f"Ошибка отправки {chat_id}: {e}")
+            return FAILED
+    return FAILED
+
+
+async def fan_out(chat_ids, send, concurrency=CONCURRENCY, limiter=limiter, on_result=None, priority=BROADCAST):
+    """
+    Рассылает сообщение по списку chat_id с ограниченной конкурентностью.
+    `send(chat_id)` — корутина, выполняющая один вызов Bot API; `priority` — полоса outbound.
+    Возвращает словарь {chat_id: SENT | FAILED | INACTIVE}.
+    """
+    results = {}
+    pending = iter(chat_ids)
+
+    async def worker():
+        # gather запускает каждого воркера в отдельной задаче с копией контекста
+        with lane(priority):
+            for chat_id in pending:
+                status = await deliver(chat_id, send, limiter)
+                results[chat_id] = status
+                BROADCAST_MESSAGES.inc(status)
+                if on_result:
+                    await on_result(chat_id, status)
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return results
+
+
+# Вызываются со списком user_id, только что помеченных неактивными (см. on_deactivate)
+_deactivate_listeners = []
+
+
+def on_deactivate(callback):
+    """Регистрирует `callback(user_ids)`, вызываемый после пометки пользователей неактивными."""
+    _deactivate_listeners.append(callback)
+
+
+async def deactivate_unreachable(pool, results):
+    """Помечает неактивными пользователей, до которых рассылка не может дойти. Возвращает их число."""
+    user_ids = [chat_id for chat_id, status in results.items() if status == INACTIVE]
+    if user_ids:
+        await repository.deactivate_users(pool, user_ids)
+        for callback in _deactivate_listeners:
+            callback(user_ids)
+    return len(user_ids)
+
+
+class DeliveryLedger:
+    """Буферизованная запись статусов доставки в broadcast_deliveries."""
+
+    def __init__(self, pool, job_id, batch_size=LEDGER_BATCH_SIZE, flush_interval=LEDGER_FLUSH_INTERVAL):
+        self.pool = pool
+        self.job_id = job_id
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._buffer = []
+        self._flushed_at = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def record(self, user_id, status):
+        self._buffer.append((user_id, status))
+        if len(self._buffer) >= self.batch_size or time.monotonic() - self._flushed_at >= self.flush_interval:
+            await self.flush()
+
+    async def flush(self):
+        async with self._lock:
+            batch, self._buffer = self._buffer, []
+            self._flushed_at = time.monotonic()
+            if not batch:
+                return
+            await repository.record_deliveries(self.pool, self.job_id,
+                                               [user_id for user_id, _ in batch], [status for _, status in batch])
+
+
+def _format_duration(seconds):
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return f"{seconds // 3600} ч {seconds % 3600 // 60} мин"
+    if seconds >= 60:
+        return f"{seconds // 60} мин {seconds % 60} с"
+    return f"{seconds} с"
+
+
+class BroadcastProgress:
+    """
+    Сообщение администратору с ходом рассылки. Обновляется отдельной задачей не чаще раза
+    в `interval` секунд, поэтому не тормозит отправку и не упирается в лимиты на редактирование.
+    """
+
+    def __init__(self, bot, chat_id, job_id, interval=PROGRESS_INTERVAL):
+        self.bot = bot
+        self.chat_id = chat_id
+        self.job_id = job_id
+        self.interval = interval
+        self.total = 0
+        self.counts = Counter()
+        self._started = None
+        self._message_id = None
+        self._last_text = None
+        self._ticker = None
+
+    def record(self, status):
+        self.counts[status] += 1
+
+    def text(self, finished=False):
+        done = sum(self.counts.values())
+        elapsed = max(time.monotonic() - self._started, 0.001)
+        rate = done / elapsed
+        text = (f"📢 Рассылка #{self.job_id}{' завершена' if finished else ''}\n"
+                f"✅ Отправлено: {self.counts[SENT]}\n"
+                f"❌ Ошибок: {self.counts[FAILED]}\n"
+                f"🚫 Недоступно: {self.counts[INACTIVE]}\n"
+                f"⏳ Осталось: {self.total - done} из {self.total}\n"
+                f"⚡ Скорость: {rate:.1f} сообщ./с")
+        if finished:
+            text += f"\n⏱ Время: {_format_duration(elapsed)}"
+        elif rate and done < self.total:
+            text += f"\n🕐 Ещё примерно: {_format_duration((self.total - done) / rate)}"
+        return text
+
+    async def start(self, total):
+        self.total = total
+        self._started = time.monotonic()
+        try:
+            message = await self.bot.send_message(self.chat_id, self.text())
+            self._message_id = message.message_id
+        except Exception as e:
+            logging.warning(f"Не удалось отправить ход рассылки #{self.job_id}: {e}")
+            return
+        self._ticker = asyncio.create_task(self._tick())
+
+    async def _tick(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            await self._update()
+
+    async def _update(self, finished=False):
+        text = self.text(finished)
+        if self._message_id is None or text == self._last_text:
+            return
+        try:
+            await self.bot.edit_message_text(text, chat_id=self.chat_id, message_id=self._message_id)
+            self._last_text = text
+        except Exception as e:
+            logging.warning(f"Не удалось обновить ход рассылки #{self.job_id}: {e}")
+
+    async def finish(self):
+        if self._ticker:
+            self._ticker.cancel()
+        await self._update(finished=True)
+
+
+def payload_from_messages(messages):
+    """
+    Рассылка копирует сообщения администратора как есть (copyMessage/copyMessages): хранится только
+    чат и id исходных сообщений, поэтому файлы не перезаливаются, а форматирование и альбомы сохраняются.
+    """
+    return {
+        "source_chat_id": messages[0].chat.id,
+        "message_ids": sorted(message.message_id for message in messages),
+    }
+
+
+def make_sender(bot, job):
+    """Возвращает корутину отправки одного сообщения рассылки по строке из broadcast_jobs."""
+    source_chat_id, message_ids = job["source_chat_id"], job["message_ids"]
+
+    async def send(chat_id):
+        if len(message_ids) == 1:
+            await bot.copy_message(chat_id, source_chat_id, message_ids[0])
+        else:
+            # Альбом копируется одним вызовом и остаётся альбомом у получателя
+            await bot.copy_messages(chat_id, source_chat_id, message_ids)
+
+    return send
+
+
+async def create_job(pool, payload, admin_chat_id, local_time=None):
+    """Сохраняет рассылку в БД и возвращает её id. `local_time` — отправка в это время по местному времени."""
+    return await repository.create_job(pool, admin_chat_id, payload["source_chat_id"], payload["message_ids"],
+                                       local_time, owner=INSTANCE_ID)
+
+
+def local_time_waves(timezones, local_time, after):
+    """
+    Делит часовые пояса на волны: {момент в UTC: [пояса]}, где момент — ближайшее после `after`
+    наступление local_time в этих поясах. Пояса с одинаковым смещением от UTC попадают в одну волну.
+    """
+    waves = defaultdict(list)
+    for name in timezones:
+        try:
+            tz = parse_timezone(name)
+        except pytz.UnknownTimeZoneError:
+            tz = pytz.utc
+        local_after = after.astimezone(tz)
+        fire_at = tz.localize(datetime.combine(local_after.date(), local_time))
+        if fire_at < local_after:
+            fire_at = tz.localize(datetime.combine(local_after.date() + timedelta(days=1), local_time))
+        waves[fire_at.astimezone(pytz.utc)].append(name)
+    return dict(sorted(waves.items()))
+
+
+async def claim_orphaned_jobs(pool):
+    """Рассылки, брошенные другим (или перезапущенным) инстансом; они закрепляются за этим инстансом."""
+    return await repository.claim_stale_jobs(pool, INSTANCE_ID, JOB_LEASE_SECONDS)
+
+
+async def renew_job_leases(pool):
+    await repository.renew_job_leases(pool, INSTANCE_ID)
+
+
+async def run_job(pool, bot, job_id, timezones=None, finish=True, progress=None):
+    """
+    Выполняет (или продолжает) рассылку. Получатели, уже записанные в broadcast_deliveries,
+    пропускаются, поэтому после рестарта отправка продолжается с места остановки.
+    `timezones` ограничивает отправку одной волной рассылки по местному времени,
+    `progress` (BroadcastProgress) показывает ход отправки администратору.
+    """
+    job = await repository.get_job(pool, job_id)
+    recipients = await repository.pending_recipients(pool, job_id, timezones)
+
+    ledger = DeliveryLedger(pool, job_id)
+
+    async def on_result(user_id, status):
+        await ledger.record(user_id, status)
+        if progress:
+            progress.record(status)
+
+    if progress:
+        await progress.start(len(recipients))
+    results = {}
+    try:
+        results = await fan_out(recipients, make_sender(bot, job), on_result=on_result)
+    finally:
+        await ledger.flush()
+        await deactivate_unreachable(pool, results)
+        if progress:
+            await progress.finish()
+
+    if finish:
+        await repository.finish_job(pool, job_id)
+    return results
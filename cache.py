@@ -0,0 +1,181 @@
+import asyncio
+import logging
+import os
+import time
+from collections import OrderedDict
+
+import repository
+from reminders import parse_schedule
+
+# Сколько секунд помним, что пользователь НЕ зарегистрирован, и сколько таких записей держим
+MISS_TTL = float(os.getenv("USER_CACHE_MISS_TTL", "60"))
+MISS_MAX_SIZE = int(os.getenv("USER_CACHE_MISS_MAX_SIZE", "10000"))
+# Как часто перечитывать неактивных пользователей: их могли пометить другие инстансы бота
+INACTIVE_REFRESH_INTERVAL = int(os.getenv("INACTIVE_REFRESH_INTERVAL", "300"))
+
+# Канал Postgres, через который инстансы бота узнают об изменении расписания
+SCHEDULE_CHANNEL = "schedule_changed"
+# Пауза между попытками восстановить LISTEN после обрыва соединения (растёт до максимума)
+LISTEN_RETRY_DELAY = 1
+LISTEN_RETRY_MAX_DELAY = 60
+
+
+class RegisteredUsers:
+    """
+    Множество user_id зарегистрированных пользователей в памяти процесса.
+    Прогревается из БД при старте; промахи перепроверяются в БД и кешируются с TTL (LRU).
+    Отдельно помнит неактивных пользователей, чтобы /start снимал пометку без запроса к БД для остальных.
+    """
+
+    def __init__(self, miss_ttl=MISS_TTL, miss_max_size=MISS_MAX_SIZE):
+        self.pool = None
+        self.miss_ttl = miss_ttl
+        self.miss_max_size = miss_max_size
+        self._ids = set()
+        self._inactive = set()
+        self._misses = OrderedDict()
+
+    async def warm(self, pool):
+        self.pool = pool
+        self._ids = set(await repository.all_user_ids(pool))
+        self._misses.clear()
+        await self.refresh_inactive()
+
+    async def refresh_inactive(self):
+        self._inactive = set(await repository.inactive_user_ids(self.pool))
+
+    def mark_inactive(self, user_ids):
+        self._inactive.update(user_ids)
+
+    async def reactivate(self, user_id):
+        """Снимает пометку неактивности; возвращает True, если пользователь был неактивен."""
+        if user_id not in self._inactive:
+            return False
+        self._inactive.discard(user_id)
+        return await repository.reactivate_user(self.pool, user_id)
+
+    def add(self, user_id):
+        self._ids.add(user_id)
+        self._misses.pop(user_id, None)
+
+    def clear(self):
+        self._ids.clear()
+        self._inactive.clear()
+        self._misses.clear()
+
+    async def is_registered(self, user_id):
+        if user_id in self._ids:
+            return True
+
+        expires_at = self._misses.get(user_id)
+        if expires_at is not None and expires_at > time.monotonic():
+            self._misses.move_to_end(user_id)
+            return False
+
+        # Промах: пользователь мог зарегистрироваться через другой инстанс бота
+        if await repository.user_exists(self.pool, user_id):
+            self.add(user_id)
+            return True
+
+        self._misses[user_id] = time.monotonic() + self.miss_ttl
+        self._misses.move_to_end(user_id)
+        while len(self._misses) > self.miss_max_size:
+            self._misses.popitem(last=False)
+        return False
+
+
+class ScheduleCache:
+    """
+    Снимок таблицы schedule (по строке на курс) с уже разобранными днями, временем и часовым поясом.
+    Сбрасывается через NOTIFY, который слушают все запущенные инстансы бота.
+    """
+
+    def __init__(self):
+        self.pool = None
+        self.rows = {}
+        self.infos = {}
+        self._listeners = []
+        self._conn = None
+        self._reload_task = None
+        self._reconnect_task = None
+        self._stopping = False
+
+    def on_change(self, callback):
+        """Регистрирует `callback(infos)`, вызываемый после каждой перезагрузки расписаний."""
+        self._listeners.append(callback)
+
+    async def start(self, pool):
+        self.pool = pool
+        self._stopping = False
+        await self.reload()
+        await self._listen()
+
+    async def stop(self):
+        self._stopping = True
+        if self._reconnect_task is not None:
+            self._reconnect_task.cancel()
+            self._reconnect_task = None
+        if self._conn is not None:
+            self._conn.remove_termination_listener(self._on_terminate)
+            await self._conn.remove_listener(SCHEDULE_CHANNEL, self._on_notify)
+            await self.pool.release(self._conn)
+            self._conn = None
+
+    async def _listen(self):
+        # Отдельное соединение из пула держится открытым ради LISTEN
+        conn = await self.pool.acquire()
+        try:
+            await conn.add_listener(SCHEDULE_CHANNEL, self._on_notify)
+        except Exception:
+            await self.pool.release(conn)
+            raise
+        conn.add_termination_listener(self._on_terminate)
+        self._conn = conn
+
+    def _on_terminate(self, connection):
+        # Соединение оборвалось (рестарт Postgres, сеть): без переподписки NOTIFY больше не придут
+        if self._stopping or connection is not self._conn:
+            return
+        logging.warning("Соединение LISTEN для расписания оборвалось, переподключаемся.")
+        self._reconnect_task = asyncio.create_task(self._reconnect())
+
+    async def _reconnect(self):
+        conn, self._conn = self._conn, None
+        try:
+            await self.pool.release(conn)
+        except Exception as e:
+            logging.debug(f"Не удалось вернуть оборванное соединение в пул: {e}")
+
+        delay = LISTEN_RETRY_DELAY
+        while not self._stopping:
+            try:
+                if self._conn is None:
+                    await self._listen()
+                # Пока соединения не было, изменения расписания могли пройти мимо
+                await self.reload()
+                logging.info("Подписка на изменения расписания восстановлена.")
+                return
+            except Exception as e:
+                logging.error(f"Не удалось восстановить LISTEN для расписания: {e}")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, LISTEN_RETRY_MAX_DELAY)
+
+    async def reload(self):
+        rows = await repository.get_schedules(self.pool)
+        self.rows = {row["id"]: row for row in rows}
+        self.infos = {row["id"]: parse_schedule(row) for row in rows}
+        for callback in self._listeners:
+            callback(self.infos)
+
+    async def invalidate(self):
+        """Сообщает всем инстансам (включая текущий), что расписание изменилось."""
+        await repository.notify(self.pool, SCHEDULE_CHANNEL)
+
+    def _on_notify(self, connection, pid, channel, payload):
+        self._reload_task = asyncio.create_task(self._reload_logged())
+
+    async def _reload_logged(self):
+        try:
+            await self.reload()
+        except Exception as e:
+            logging.error(f"Не удалось перезагрузить расписание: {e}")
@@ -0,0 +1,51 @@
+import asyncio
+import logging
+import os
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Текстовые материалы бота: ключ -> файл
+CONTENT_FILES = {
+    "course_info": "question.txt",
+    "organization": "question_3.txt",
+    "faq": "FAQ.txt",
+}
+
+# Как часто (в секундах) проверять, не изменились ли файлы на диске
+CONTENT_CHECK_INTERVAL = int(os.getenv("CONTENT_CHECK_INTERVAL", "60"))
+
+
+class ContentStore:
+    """Тексты из файлов, загруженные в память один раз и перечитываемые только при изменении mtime."""
+
+    def __init__(self, files=CONTENT_FILES, base_dir=BASE_DIR):
+        self.files = files
+        self.base_dir = base_dir
+        self._texts = {}
+        self._mtimes = {}
+
+    def get(self, key):
+        return self._texts[key]
+
+    def _read_changed(self, force=False):
+        changed = {}
+        for key, filename in self.files.items():
+            path = os.path.join(self.base_dir, filename)
+            try:
+                mtime = os.stat(path).st_mtime
+                if force or self._mtimes.get(key) != mtime:
+                    with open(path, "r", encoding="utf-8") as f:
+                        changed[key] = (f.read(), mtime)
+            except OSError as e:
+                logging.error(f"Не удалось прочитать {path}: {e}")
+        return changed
+
+    async def refresh(self, force=False):
+        """Перечитывает изменённые файлы в отдельном потоке, не блокируя event loop."""
+        changed = await asyncio.to_thread(self._read_changed, force)
+        for key, (text, mtime) in changed.items():
+            self._texts[key] = text
+            self._mtimes[key] = mtime
+        if changed:
+            logging.info(f"Обновлены тексты: {', '.join(changed)}")
+        return list(changed)
@@ -0,0 +1,142 @@
+import asyncio
+import csv
+import os
+import tempfile
+from datetime import datetime, timedelta
+
+# Колонки, которые можно выгрузить: имя в БД -> заголовок в файле
+EXPORT_COLUMNS = {
+    "full_name": "ФИО",
+    "country": "Страна",
+    "age": "Д.Рождения",
+    "phone": "Телефон",
+    "timezone": "Часовой пояс",
+    "registration_time": "Дата регистрации",
+}
+DEFAULT_COLUMNS = ["full_name", "country", "age", "phone"]
+EXPORT_FORMATS = ("xlsx", "csv")
+
+# Сколько строк читается из курсора и пишется в файл за один раз
+FETCH_CHUNK = 1000
+
+EXPORT_USAGE = (
+    "Формат: /export [csv|xlsx] [cols=full_name,phone,...] [from=ГГГГ-ММ-ДД] [to=ГГГГ-ММ-ДД]\n"
+    "Обе даты включаются в выгрузку.\n"
+    f"Доступные колонки: {', '.join(EXPORT_COLUMNS)}"
+)
+
+
+def parse_export_args(args):
+    """Разбирает аргументы команды /export. Бросает ValueError при некорректном вводе."""
+    options = {"fmt": "xlsx", "columns": DEFAULT_COLUMNS, "date_from": None, "date_to": None}
+    for arg in args:
+        key, _, value = arg.partition("=")
+        if not value and key.lower() in EXPORT_FORMATS:
+            options["fmt"] = key.lower()
+        elif key == "cols":
+            columns = [c.strip() for c in value.split(",") if c.strip()]
+            if not columns or not set(columns).issubset(EXPORT_COLUMNS):
+                raise ValueError(f"Неизвестные колонки: {value}")
+            options["columns"] = columns
+        elif key in ("from", "to"):
+            options["date_" + key] = datetime.strptime(value, "%Y-%m-%d")
+        else:
+            raise ValueError(f"Неизвестный параметр: {arg}")
+    return options
+
+
+class _XlsxWriter:
+    """XLSX в режиме write-only: строки сразу сбрасываются во временный файл, а не копятся в памяти."""
+
+    def __init__(self, path, header):
+        from openpyxl import Workbook
+
+        self.path = path
+        self.workbook = Workbook(write_only=True)
+        self.sheet = self.workbook.create_sheet("Ученики")
+        self.sheet.append(header)
+
+    def write_rows(self, rows):
+        for row in rows:
+            self.sheet.append(row)
+
+    def close(self):
+        self.workbook.save(self.path)
+
+
+class _CsvWriter:
+    def __init__(self, path, header):
+        self.file = open(path, "w", encoding="utf-8-sig", newline="")
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(header)
+
+    def write_rows(self, rows):
+        self.writer.writerows(rows)
+
+    def close(self):
+        self.file.close()
+
+
+# Результаты рассылки по получателям (см. export_deliveries)
+DELIVERY_HEADER = ["user_id", "ФИО", "Статус"]
+_JOB_DELIVERIES = """
+    SELECT d.user_id, u.full_name, d.status FROM broadcast_deliveries d
+    LEFT JOIN users u ON u.user_id = d.user_id
+    WHERE d.job_id = $1
+    ORDER BY d.user_id
+"""
+
+
+async def export_students(pool, fmt="xlsx", columns=DEFAULT_COLUMNS, date_from=None, date_to=None):
+    """
+    Выгружает учеников во временный файл. Возвращает (путь к файлу, число строк).
+    Период [date_from, date_to] включает оба дня.
+    """
+    # registration_time хранит время, поэтому верхняя граница — начало следующего дня
+    if date_to is not None:
+        date_to += timedelta(days=1)
+    # Имена колонок подставляются только из белого списка EXPORT_COLUMNS
+    query = f"""
+        SELECT {", ".join(columns)} FROM users
+        WHERE ($1::timestamp IS NULL OR registration_time >= $1)
+          AND ($2::timestamp IS NULL OR registration_time < $2)
+        ORDER BY user_id
+    """
+    header = [EXPORT_COLUMNS[column] for column in columns]
+    return await _export_query(pool, query, [date_from, date_to], header, fmt)
+
+
+async def export_deliveries(pool, job_id):
+    """Выгружает в CSV статус доставки рассылки каждому получателю. Возвращает (путь к файлу, число строк)."""
+    return await _export_query(pool, _JOB_DELIVERIES, [job_id], DELIVERY_HEADER, "csv")
+
+
+async def _export_query(pool, query, args, header, fmt):
+    """
+    Пишет результат запроса во временный файл, читая его серверным курсором по FETCH_CHUNK строк.
+    Кодирование выполняется в отдельном потоке; файл удаляет вызывающая сторона.
+    """
+    fd, path = tempfile.mkstemp(suffix=f".{fmt}")
+    os.close(fd)
+
+    writer_class = _CsvWriter if fmt == "csv" else _XlsxWriter
+    writer = await asyncio.to_thread(writer_class, path, header)
+
+    count = 0
+    chunk = []
+    try:
+        async with pool.acquire() as conn:
+            async with conn.transaction():
+                async for row in conn.cursor(query, *args, prefetch=FETCH_CHUNK):
+                    chunk.append(tuple(row))
+                    if len(chunk) >= FETCH_CHUNK:
+                        await asyncio.to_thread(writer.write_rows, chunk)
+                        count += len(chunk)
+                        chunk = []
+        if chunk:
+            await asyncio.to_thread(writer.write_rows, chunk)
+            count += len(chunk)
+    finally:
+        await asyncio.to_thread(writer.close)
+
+    return path, count
@@ -0,0 +1,78 @@
+import json
+import os
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage
+
+# Через сколько часов бездействия незавершённая регистрация или админский диалог удаляются
+FSM_TTL_HOURS = int(os.getenv("FSM_TTL_HOURS", "168"))
+
+_KEY_WHERE = "bot_id = $1 AND chat_id = $2 AND user_id = $3 AND thread_id = $4 AND destiny = $5"
+
+
+def _key_args(key):
+    return key.bot_id, key.chat_id, key.user_id, key.thread_id or 0, key.destiny
+
+
+class PostgresStorage(BaseStorage):
+    """
+    FSM-хранилище aiogram в таблице fsm_storage на общем пуле asyncpg.
+    Все записи — upsert в одну строку на (chat, user), поэтому состояние переживает рестарт
+    и доступно всем инстансам бота. Пул задаётся после подключения к БД.
+    """
+
+    def __init__(self, pool=None):
+        self.pool = pool
+
+    async def set_state(self, key, state=None):
+        state = state.state if isinstance(state, State) else state
+        async with self.pool.acquire() as conn:
+            await conn.execute(f"""
+                INSERT INTO fsm_storage (bot_id, chat_id, user_id, thread_id, destiny, state)
+                VALUES ($1, $2, $3, $4, $5, $6)
+                ON CONFLICT (bot_id, chat_id, user_id, thread_id, destiny)
+                DO UPDATE SET state = EXCLUDED.state, updated_at = CURRENT_TIMESTAMP
+            """, *_key_args(key), state)
+
+    async def get_state(self, key):
+        async with self.pool.acquire() as conn:
+            return await conn.fetchval(f"SELECT state FROM fsm_storage WHERE {_KEY_WHERE}", *_key_args(key))
+
+    async def set_data(self, key, data):
+        async with self.pool.acquire() as conn:
+            await conn.execute(f"""
+                INSERT INTO fsm_storage (bot_id, chat_id, user_id, thread_id, destiny, data)
+                VALUES ($1, $2, $3, $4, $5, $6::jsonb)
+                ON CONFLICT (bot_id, chat_id, user_id, thread_id, destiny)
+                DO UPDATE SET data = EXCLUDED.data, updated_at = CURRENT_TIMESTAMP
+            """, *_key_args(key), json.dumps(data))
+
+    async def get_data(self, key):
+        async with self.pool.acquire() as conn:
+            data = await conn.fetchval(f"SELECT data FROM fsm_storage WHERE {_KEY_WHERE}", *_key_args(key))
+        return json.loads(data) if data else {}
+
+    async def update_data(self, key, data):
+        """Слияние на стороне БД за один запрос вместо get_data + set_data."""
+        async with self.pool.acquire() as conn:
+            merged = await conn.fetchval(f"""
+                INSERT INTO fsm_storage (bot_id, chat_id, user_id, thread_id, destiny, data)
+                VALUES ($1, $2, $3, $4, $5, $6::jsonb)
+                ON CONFLICT (bot_id, chat_id, user_id, thread_id, destiny)
+                DO UPDATE SET data = fsm_storage.data || EXCLUDED.data, updated_at = CURRENT_TIMESTAMP
+                RETURNING data
+            """, *_key_args(key), json.dumps(data))
+        return json.loads(merged)
+
+    async def cleanup(self, ttl_hours=FSM_TTL_HOURS):
+        """Удаляет пустые записи и брошенные на полпути диалоги."""
+        async with self.pool.acquire() as conn:
+            await conn.execute("""
+                DELETE FROM fsm_storage
+                WHERE (state IS NULL AND data = '{}'::jsonb)
+                   OR updated_at < CURRENT_TIMESTAMP - make_interval(hours => $1)
+            """, ttl_hours)
+
+    async def close(self):
+        # Пул принадлежит боту и закрывается в main()
+        pass
@@ -0,0 +1,129 @@
+import asyncio
+import csv
+import io
+import zipfile
+
+from timezones import timezone_for_country
+
+IMPORT_COLUMNS = ["user_id", "full_name", "country", "age", "phone", "timezone"]
+
+# Допустимые значения: user_id помещается в BIGINT, возраст — как при регистрации в боте
+MAX_USER_ID = 2 ** 63 - 1
+MIN_AGE, MAX_AGE = 10, 120
+
+# Заголовки столбцов в файле (без учёта регистра) -> колонка таблицы users.
+# Русские варианты совпадают с заголовками выгрузки из export.py.
+HEADER_ALIASES = {
+    "user_id": "user_id", "id": "user_id",
+    "full_name": "full_name", "фио": "full_name",
+    "country": "country", "страна": "country",
+    "age": "age", "возраст": "age", "д.рождения": "age",
+    "phone": "phone", "телефон": "phone",
+}
+
+IMPORT_USAGE = (
+    "Отправьте файл CSV или XLSX. Первая строка — заголовки: "
+    "user_id, full_name (ФИО), country (Страна), age (Возраст), phone (Телефон)."
+)
+
+
+def _read_rows(data, filename):
+    if filename.lower().endswith(".xlsx"):
+        from openpyxl import load_workbook
+        from openpyxl.utils.exceptions import InvalidFileException
+
+        try:
+            workbook = load_workbook(io.BytesIO(data), read_only=True)
+        except (zipfile.BadZipFile, InvalidFileException, KeyError):
+            raise ValueError("Не удалось прочитать XLSX-файл.")
+        yield from workbook.active.iter_rows(values_only=True)
+        workbook.close()
+    else:
+        try:
+            text = data.decode("utf-8-sig")
+        except UnicodeDecodeError:
+            raise ValueError("CSV-файл должен быть в кодировке UTF-8.")
+        try:
+            dialect = csv.Sniffer().sniff(text[:4096], delimiters=",;\t")
+        except csv.Error:
+            # Пустой файл или один столбец: разделитель не определить, читаем как обычный CSV
+            dialect = csv.excel
+        try:
+            yield from csv.reader(io.StringIO(text), dialect)
+        except csv.Error as e:
+            raise ValueError(f"Не удалось прочитать CSV-файл: {e}")
+
+
+def _to_record(values):
+    """Проверяет строку файла; возвращает кортеж для COPY или None, если строка некорректна."""
+    try:
+        user_id = int(values["user_id"])
+        full_name = str(values["full_name"] or "").strip()
+        country = str(values["country"] or "").strip()
+        age = int(values["age"])
+    except (KeyError, TypeError, ValueError):
+        return None
+    if not full_name or not country:
+        return None
+    if not 0 < user_id <= MAX_USER_ID or not MIN_AGE <= age <= MAX_AGE:
+        return None
+    phone = values.get("phone")
+    phone = str(phone).strip() if phone is not None else None
+    return user_id, full_name, country, age, phone, timezone_for_country(country) or "UTC"
+
+
+def parse_users_file(data, filename):
+    """Разбирает файл в записи для COPY. Возвращает (записи, число некорректных строк)."""
+    rows = _read_rows(data, filename)
+    header = next(rows, None)
+    if not header:
+        raise ValueError("Файл пустой.")
+
+    columns = [HEADER_ALIASES.get(str(name or "").strip().lower()) for name in header]
+    missing = {"user_id", "full_name", "country", "age"} - set(columns)
+    if missing:
+        raise ValueError(f"Нет обязательных столбцов: {', '.join(sorted(missing))}")
+
+    records, invalid = [], 0
+    for row in rows:
+        if not any(row):
+            continue
+        record = _to_record({column: value for column, value in zip(columns, row) if column})
+        if record:
+            records.append(record)
+        else:
+            invalid += 1
+    return records, invalid
+
+
+async def import_users(pool, data, filename):
+    """
+    Загружает пользователей из CSV/XLSX: COPY во временную таблицу и один INSERT ... SELECT в users.
+    Возвращает (id добавленных пользователей, число дубликатов, число некорректных строк).
+    """
+    records, invalid = await asyncio.to_thread(parse_users_file, data, filename)
+
+    async with pool.acquire() as conn:
+        async with conn.transaction():
+            await conn.execute("""
+                CREATE TEMP TABLE users_import (
+                    user_id BIGINT, full_name TEXT, country TEXT, age INTEGER, phone TEXT, timezone TEXT
+                ) ON COMMIT DROP
+            """)
+            await conn.copy_records_to_table("users_import", records=records, columns=IMPORT_COLUMNS)
+            inserted = await conn.fetch("""
+                INSERT INTO users (user_id, full_name, country, age, phone, timezone)
+                SELECT DISTINCT ON (user_id) user_id, full_name, country, age, phone, timezone FROM users_import
+                ORDER BY user_id
+                ON CONFLICT (user_id) DO NOTHING
+                RETURNING user_id
+            """)
+            # На основной курс подписываются только новые пользователи: уже существующие могли от него отписаться
+            inserted_ids = [row["user_id"] for row in inserted]
+            await conn.execute("""
+                INSERT INTO subscriptions (user_id, schedule_id)
+                SELECT u.user_id, s.id FROM unnest($1::bigint[]) AS u (user_id), (SELECT id FROM schedule ORDER BY id LIMIT 1) s
+                ON CONFLICT DO NOTHING
+            """, inserted_ids)
+
+    return inserted_ids, len(records) - len(inserted_ids), invalid
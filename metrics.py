@@ -0,0 +1,276 @@
+import os
+import re
+import time
+from bisect import bisect_left
+
+from aiohttp import web
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+
+# Если задан, /metrics требует заголовок "Authorization: Bearer <METRICS_TOKEN>"
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+# Порт отдельного HTTP-сервера с /metrics. В режиме webhook без него /metrics отдаётся
+# на публичном сервере и только при заданном METRICS_TOKEN
+METRICS_PORT = os.getenv("METRICS_PORT")
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class _Series:
+    __slots__ = ("buckets", "sum", "count")
+
+    def __init__(self, size):
+        self.buckets = [0] * size
+        self.sum = 0.0
+        self.count = 0
+
+
+class Histogram:
+    """Гистограмма длительностей в формате Prometheus, по одной серии на значение метки."""
+
+    def __init__(self, name, description, label=None, buckets=BUCKETS):
+        self.name = name
+        self.description = description
+        self.label = label
+        self.buckets = buckets
+        self.series = {}
+
+    def observe(self, seconds, label_value=None):
+        series = self.series.get(label_value)
+        if series is None:
+            series = self.series[label_value] = _Series(len(self.buckets) + 1)
+        series.buckets[bisect_left(self.buckets, seconds)] += 1
+        series.sum += seconds
+        series.count += 1
+
+    def quantile(self, q, label_value=None):
+        """Оценка квантиля сверху: граница бакета, в который он попадает."""
+        series = self.series.get(label_value)
+        if not series or not series.count:
+            return None
+        rank = q * series.count
+        cumulative = 0
+        for bound, count in zip(self.buckets, series.buckets):
+            cumulative += count
+            if cumulative >= rank:
+                return bound
+        return float("inf")
+
+    def _labels(self, label_value, extra=""):
+        parts = []
+        if self.label:
+            parts.append(f'{self.label}="{_escape(label_value)}"')
+        if extra:
+            parts.append(extra)
+        return "{" + ",".join(parts) + "}" if parts else ""
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} histogram"]
+        for label_value, series in self.series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series.buckets):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                le_label = f'le="{le}"'
+                lines.append(f"{self.name}_bucket{self._labels(label_value, le_label)} {cumulative}")
+            lines.append(f"{self.name}_sum{self._labels(label_value)} {series.sum}")
+            lines.append(f"{self.name}_count{self._labels(label_value)} {series.count}")
+        return lines
+
+
+class Counter:
+    def __init__(self, name, description, label=None):
+        self.name = name
+        self.description = description
+        self.label = label
+        self.values = {}
+
+    def inc(self, label_value=None, amount=1):
+        self.values[label_value] = self.values.get(label_value, 0) + amount
+
+    def total(self):
+        return sum(self.values.values())
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} counter"]
+        for label_value, value in self.values.items():
+            labels = f'{{{self.label}="{_escape(label_value)}"}}' if self.label else ""
+            lines.append(f"{self.name}{labels} {value}")
+        return lines
+
+
+HANDLER_LATENCY = Histogram("bot_handler_seconds", "Время работы хендлеров aiogram", "handler")
+HANDLER_ERRORS = Counter("bot_handler_errors_total", "Исключения в хендлерах", "handler")
+SQL_LATENCY = Histogram("db_query_seconds", "Время выполнения SQL-запросов", "statement")
+SQL_ERRORS = Counter("db_query_errors_total", "Ошибки SQL-запросов", "statement")
+POOL_WAIT = Histogram("db_pool_acquire_seconds", "Ожидание свободного соединения в пуле")
+TELEGRAM_LATENCY = Histogram("telegram_request_seconds", "Время вызовов Bot API", "method")
+TELEGRAM_ERRORS = Counter("telegram_errors_total", "Ошибки вызовов Bot API", "method")
+BROADCAST_MESSAGES = Counter("broadcast_messages_total", "Сообщения массовых рассылок по статусу", "status")
+THROTTLED_UPDATES = Counter("bot_throttled_updates_total", "Отброшенные обновления от пользователей", "reason")
+OUTBOUND_WAIT = Histogram("outbound_queue_seconds", "Ожидание в очереди исходящих сообщений", "lane")
+
+METRICS = [
+    HANDLER_LATENCY, HANDLER_ERRORS, THROTTLED_UPDATES,
+    SQL_LATENCY, SQL_ERRORS, POOL_WAIT,
+    TELEGRAM_LATENCY, TELEGRAM_ERRORS,
+    BROADCAST_MESSAGES, OUTBOUND_WAIT,
+]
+
+
+class MetricsMiddleware(BaseMiddleware):
+    """Внутренний middleware роутера: замеряет время каждого хендлера."""
+
+    async def __call__(self, handler, event, data):
+        handler_object = data.get("handler")
+        name = handler_object.callback.__name__ if handler_object else "unknown"
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            HANDLER_ERRORS.inc(name)
+            raise
+        finally:
+            HANDLER_LATENCY.observe(time.perf_counter() - started, name)
+
+
+class TelegramMetricsMiddleware(BaseRequestMiddleware):
+    """Middleware сессии бота: время и ошибки каждого вызова Bot API."""
+
+    async def __call__(self, make_request, bot, method):
+        name = type(method).__name__
+        started = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        except Exception:
+            TELEGRAM_ERRORS.inc(name)
+            raise
+        finally:
+            TELEGRAM_LATENCY.observe(time.perf_counter() - started, name)
+
+
+def _statement_label(query):
+    return re.sub(r"\s+", " ", query).strip()[:80]
+
+
+def _log_query(record):
+    label = _statement_label(record.query)
+    SQL_LATENCY.observe(record.elapsed, label)
+    if record.exception is not None:
+        SQL_ERRORS.inc(label)
+
+
+async def instrument_connection(conn):
+    """init-хук пула asyncpg: подключает замер времени запросов к каждому соединению."""
+    conn.add_query_logger(_log_query)
+
+
+class _TimedAcquire:
+    """Обёртка над pool.acquire(), поддерживающая и `await`, и `async with`."""
+
+    def __init__(self, context):
+        self._context = context
+
+    async def __aenter__(self):
+        started = time.perf_counter()
+        conn = await self._context.__aenter__()
+        POOL_WAIT.observe(time.perf_counter() - started)
+        return conn
+
+    async def __aexit__(self, *exc_info):
+        return await self._context.__aexit__(*exc_info)
+
+    def __await__(self):
+        return self.__aenter__().__await__()
+
+
+class InstrumentedPool:
+    """Прокси пула asyncpg, замеряющий время ожидания соединения."""
+
+    def __init__(self, pool):
+        self._pool = pool
+
+    def acquire(self, **kwargs):
+        return _TimedAcquire(self._pool.acquire(**kwargs))
+
+    def __getattr__(self, name):
+        return getattr(self._pool, name)
+
+
+def render(pool=None):
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.render())
+    if pool is not None:
+        lines += [
+            "# TYPE db_pool_size gauge", f"db_pool_size {pool.get_size()}",
+            "# TYPE db_pool_idle gauge", f"db_pool_idle {pool.get_idle_size()}",
+            "# TYPE db_pool_max_size gauge", f"db_pool_max_size {pool.get_max_size()}",
+        ]
+    return "\n".join(lines) + "\n"
+
+
+def _format_ms(seconds):
+    if seconds is None:
+        return "—"
+    return "∞" if seconds == float("inf") else f"{seconds * 1000:.0f} мс"
+
+
+def stats_report(pool=None, limit=10):
+    """Краткая сводка для админской команды /stats."""
+    report = "📊 Статистика\n\nХендлеры (вызовов, p50, p99):\n"
+    handlers = sorted(HANDLER_LATENCY.series.items(), key=lambda item: item[1].count, reverse=True)
+    for name, series in handlers[:limit]:
+        report += (f"• {name}: {series.count}, {_format_ms(HANDLER_LATENCY.quantile(0.5, name))}, "
+                   f"{_format_ms(HANDLER_LATENCY.quantile(0.99, name))}\n")
+
+    if THROTTLED_UPDATES.values:
+        throttled = ", ".join(f"{reason} {count}" for reason, count in THROTTLED_UPDATES.values.items())
+        report += f"\nОтброшено обновлений: {throttled}\n"
+
+    requests = sum(series.count for series in TELEGRAM_LATENCY.series.values())
+    errors = TELEGRAM_ERRORS.total()
+    error_rate = errors / requests * 100 if requests else 0
+    report += f"\nBot API: {requests} вызовов, ошибок {errors} ({error_rate:.1f}%)\n"
+
+    queries = sum(series.count for series in SQL_LATENCY.series.values())
+    report += f"SQL: {queries} запросов, ошибок {SQL_ERRORS.total()}\n"
+    report += f"Ожидание пула: p99 {_format_ms(POOL_WAIT.quantile(0.99))}\n"
+    if pool is not None:
+        report += (f"Пул БД: {pool.get_size() - pool.get_idle_size()} занято / "
+                   f"{pool.get_size()} открыто / максимум {pool.get_max_size()}\n")
+
+    if OUTBOUND_WAIT.series:
+        lanes = ", ".join(f"{name} {_format_ms(OUTBOUND_WAIT.quantile(0.99, name))}" for name in OUTBOUND_WAIT.series)
+        report += f"Очередь исходящих (p99): {lanes}\n"
+
+    sent = BROADCAST_MESSAGES.values.get("sent", 0)
+    inactive = BROADCAST_MESSAGES.values.get("inactive", 0)
+    failed = BROADCAST_MESSAGES.total() - sent - inactive
+    report += f"Рассылки: доставлено {sent}, ошибок {failed}, недоступных чатов {inactive}"
+    return report
+
+
+def setup_routes(app, pool=None):
+    """Добавляет GET /metrics в формате Prometheus в приложение aiohttp."""
+
+    async def handle(request):
+        if METRICS_TOKEN and request.headers.get("Authorization") != f"Bearer {METRICS_TOKEN}":
+            raise web.HTTPUnauthorized()
+        return web.Response(text=render(pool), content_type="text/plain", charset="utf-8")
+
+    app.router.add_get("/metrics", handle)
+
+
+async def start_server(pool, host, port):
+    """Отдельный сервер для /metrics (режим polling). Возвращает runner для остановки."""
+    app = web.Application()
+    setup_routes(app, pool)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
@@ -1,43 +1,109 @@
-import asyncpg
-import os
-from dotenv import load_dotenv
+async def create_tables(pool):
+    """Создаёт таблицы в БД, если их нет."""
+    async with pool.acquire() as conn:
+        subscriptions_missing = await conn.fetchval("SELECT to_regclass('subscriptions') IS NULL")
+        await conn.execute("""
+            CREATE TABLE IF NOT EXISTS users (
+                user_id BIGINT PRIMARY KEY,
+                full_name TEXT NOT NULL,
+                country TEXT NOT NULL,
+                age INTEGER NOT NULL,
+                phone TEXT,
+                timezone VARCHAR DEFAULT 'UTC',
+                registration_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            
+            );
 
-load_dotenv()
-DATABASE_URL = os.getenv("DATABASE_URL")
+            -- Пользователи, заблокировавшие бота или удалившие аккаунт, помечаются неактивными
+            -- и не попадают в рассылки; частичный индекс покрывает выборку активных получателей
+            ALTER TABLE users ADD COLUMN IF NOT EXISTS inactive_at TIMESTAMP;
+            CREATE INDEX IF NOT EXISTS users_active_idx ON users (user_id) WHERE inactive_at IS NULL;
 
+            -- Индексы для поиска пользователей по подстроке и похожести (см. search.py)
+            CREATE EXTENSION IF NOT EXISTS pg_trgm;
+            CREATE INDEX IF NOT EXISTS users_full_name_trgm_idx ON users USING gin (LOWER(full_name) gin_trgm_ops);
+            CREATE INDEX IF NOT EXISTS users_country_trgm_idx ON users USING gin (LOWER(country) gin_trgm_ops);
 
-async def create_tables():
-    """Создаёт таблицы в БД, если их нет."""
-    conn = await asyncpg.connect(DATABASE_URL)
-    await conn.execute("""
-        CREATE TABLE IF NOT EXISTS users (
-            user_id BIGINT PRIMARY KEY,
-            full_name TEXT NOT NULL,
-            country TEXT NOT NULL,
-            age INTEGER NOT NULL,
-            phone TEXT,
-            timezone VARCHAR DEFAULT 'UTC',
-            registration_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            
-        );
+            CREATE TABLE IF NOT EXISTS schedule (
+                id SERIAL PRIMARY KEY,
+                text TEXT NOT NULL,
+                days TEXT NOT NULL,
+                time TEXT NOT NULL,
+                timezone TEXT NOT NULL
+            );
+            ALTER TABLE schedule ADD COLUMN IF NOT EXISTS name TEXT NOT NULL DEFAULT 'Основной курс';
+
+            CREATE TABLE IF NOT EXISTS broadcast_jobs (
+                id SERIAL PRIMARY KEY,
+                admin_chat_id BIGINT NOT NULL,
+                -- Рассылка копирует исходное сообщение (или альбом) администратора: чат и id сообщений
+                source_chat_id BIGINT NOT NULL,
+                message_ids BIGINT[] NOT NULL,
+                status TEXT NOT NULL DEFAULT 'running',
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                finished_at TIMESTAMP,
+                -- Инстанс бота, выполняющий рассылку, и когда он последний раз продлил аренду
+                owner TEXT,
+                heartbeat_at TIMESTAMPTZ
+            );
+            -- Рассылка «в ЧЧ:ММ по местному времени получателя»: время и момент, от которого планируются волны
+            ALTER TABLE broadcast_jobs ADD COLUMN IF NOT EXISTS local_time TIME;
+            ALTER TABLE broadcast_jobs ADD COLUMN IF NOT EXISTS scheduled_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP;
+
+            CREATE TABLE IF NOT EXISTS broadcast_deliveries (
+                job_id INTEGER NOT NULL REFERENCES broadcast_jobs (id) ON DELETE CASCADE,
+                user_id BIGINT NOT NULL,
+                status TEXT NOT NULL,
+                PRIMARY KEY (job_id, user_id)
+            );
+
+            CREATE TABLE IF NOT EXISTS fsm_storage (
+                bot_id BIGINT NOT NULL,
+                chat_id BIGINT NOT NULL,
+                user_id BIGINT NOT NULL,
+                thread_id BIGINT NOT NULL DEFAULT 0,
+                destiny TEXT NOT NULL DEFAULT 'default',
+                state TEXT,
+                data JSONB NOT NULL DEFAULT '{}',
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (bot_id, chat_id, user_id, thread_id, destiny)
+            );
+            CREATE INDEX IF NOT EXISTS fsm_storage_updated_at_idx ON fsm_storage (updated_at);
+
+            INSERT INTO schedule (text, days, time, timezone)
+            SELECT 'Курс проходит дважды в неделю.', 'Вт, Чт', '19:30', 'UTC+6'
+            WHERE NOT EXISTS (SELECT 1 FROM schedule);
+
+            -- Подписки пользователей на курсы (строки schedule)
+            CREATE TABLE IF NOT EXISTS subscriptions (
+                user_id BIGINT NOT NULL REFERENCES users (user_id) ON DELETE CASCADE,
+                schedule_id INTEGER NOT NULL REFERENCES schedule (id) ON DELETE CASCADE,
+                PRIMARY KEY (user_id, schedule_id)
+            );
+            CREATE INDEX IF NOT EXISTS subscriptions_schedule_id_idx ON subscriptions (schedule_id, user_id);
 
-        CREATE TABLE IF NOT EXISTS schedule (
-            id SERIAL PRIMARY KEY,
-            text TEXT NOT NULL,
-            days TEXT NOT NULL,
-            time TEXT NOT NULL,
-            timezone TEXT NOT NULL
-        );
+            -- Журнал напоминаний: каждое напоминание о занятии уходит пользователю ровно один раз
+            CREATE TABLE IF NOT EXISTS reminder_deliveries (
+                user_id BIGINT NOT NULL,
+                lesson_at TIMESTAMPTZ NOT NULL,
+                kind TEXT NOT NULL,
+                PRIMARY KEY (user_id, lesson_at, kind)
+            );
+            CREATE INDEX IF NOT EXISTS reminder_deliveries_lesson_at_idx ON reminder_deliveries (lesson_at);
+        """)
 
-        INSERT INTO schedule (text, days, time, timezone)
-        SELECT 'Курс проходит дважды в неделю.', 'Вт, Чт', '19:30', 'UTC+6'
-        WHERE NOT EXISTS (SELECT 1 FROM schedule);
-    """)
-    await conn.close()
+        if subscriptions_missing:
+            # Пользователи, зарегистрированные до появления курсов, один раз подписываются на первый курс;
+            # дальше пустая таблица подписок — нормальное состояние (все отписались)
+            await conn.execute("""
+                INSERT INTO subscriptions (user_id, schedule_id)
+                SELECT u.user_id, s.id FROM users u, (SELECT id FROM schedule ORDER BY id LIMIT 1) s
+                ON CONFLICT DO NOTHING
+            """)
 
 
-async def init_db():
-    await create_tables()
+async def init_db(pool):
+    await create_tables(pool)
 
 
 
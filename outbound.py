@@ -0,0 +1,150 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramRetryAfter
+
+from metrics import OUTBOUND_WAIT
+
+# Лимит Telegram: ~30 сообщений в секунду на бота (общий для ответов, напоминаний и рассылок)
+GLOBAL_RATE = float(os.getenv("OUTBOUND_RATE", os.getenv("BROADCAST_RATE", "28")))
+GLOBAL_BURST = float(os.getenv("OUTBOUND_BURST", "5"))
+
+# Полосы приоритета: меньшее значение обслуживается раньше
+INTERACTIVE = 0
+REMINDER = 1
+BROADCAST = 2
+LANE_NAMES = {INTERACTIVE: "interactive", REMINDER: "reminder", BROADCAST: "broadcast"}
+
+# Полоса текущей задачи; по умолчанию всё, что отправляют хендлеры, — ответы пользователю
+current_lane = ContextVar("outbound_lane", default=INTERACTIVE)
+
+
+@contextmanager
+def lane(value):
+    """Все вызовы Bot API внутри блока идут через указанную полосу."""
+    token = current_lane.set(value)
+    try:
+        yield
+    finally:
+        current_lane.reset(token)
+
+
+class TokenBucket:
+    """Token bucket: не больше `rate` операций в секунду с запасом `capacity`."""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def pause(self, seconds):
+        """Останавливает выдачу токенов (например, после RetryAfter от Telegram)."""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._tokens = 0
+        # Иначе после паузы пополнение посчитается от старого момента и выдаст весь запас разом
+        self._updated = self._paused_until
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class OutboundDispatcher(BaseRequestMiddleware):
+    """
+    Middleware сессии бота: единая очередь всех исходящих сообщений.
+    Токены общего лимита выдаются по приоритету полос (ответы > напоминания > рассылки),
+    а вызовы в один чат выполняются строго по очереди.
+    """
+
+    def __init__(self, rate=GLOBAL_RATE, burst=GLOBAL_BURST):
+        self.bucket = TokenBucket(rate, burst)
+        self._waiters = []
+        self._seq = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._pump = None
+        self._chats = {}
+
+    def pause(self, seconds):
+        self.bucket.pause(seconds)
+
+    async def _grant(self):
+        """Раздаёт токены ожидающим в порядке (полоса, очередь)."""
+        while True:
+            while not self._waiters:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+            await self.bucket.acquire()
+            while self._waiters:
+                _, _, future = heapq.heappop(self._waiters)
+                if not future.done():
+                    future.set_result(None)
+                    break
+
+    async def _acquire(self, priority):
+        if self._pump is None or self._pump.done():
+            self._pump = asyncio.create_task(self._grant())
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), future))
+        self._wakeup.set()
+        await future
+
+    @contextmanager
+    def _chat_slot(self, chat_id):
+        """Счётчик ссылок на блокировку чата, чтобы словарь не рос бесконечно."""
+        slot = self._chats.get(chat_id)
+        if slot is None:
+            slot = self._chats[chat_id] = [asyncio.Lock(), 0]
+        slot[1] += 1
+        try:
+            yield slot[0]
+        finally:
+            slot[1] -= 1
+            if not slot[1]:
+                del self._chats[chat_id]
+
+    async def __call__(self, make_request, bot, method):
+        chat_id = getattr(method, "chat_id", None)
+        if chat_id is None:
+            # getUpdates, answerCallbackQuery и служебные вызовы не входят в лимит сообщений
+            return await make_request(bot, method)
+
+        # Сначала очередь по приоритету, и только потом блокировка чата: иначе ответ пользователю
+        # ждал бы за сообщением рассылки в тот же чат, стоящим в самой медленной полосе.
+        # Токены в одной полосе выдаются по порядку, поэтому порядок вызовов в чат сохраняется
+        priority = current_lane.get()
+        started = time.perf_counter()
+        await self._acquire(priority)
+        OUTBOUND_WAIT.observe(time.perf_counter() - started, LANE_NAMES[priority])
+        with self._chat_slot(chat_id) as chat_lock:
+            async with chat_lock:
+                try:
+                    return await make_request(bot, method)
+                except TelegramRetryAfter as e:
+                    logging.warning(f"Flood control: исходящие сообщения остановлены на {e.retry_after} сек.")
+                    self.pause(e.retry_after)
+                    raise
+
+
+# Один диспетчер на процесс: подключается к сессии бота в bot.py
+dispatcher = OutboundDispatcher()
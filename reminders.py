@@ -0,0 +1,119 @@
+import asyncio
+import heapq
+import logging
+import re
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+import pytz
+
+# Русские дни недели -> номер дня (datetime.weekday())
+DAYS_MAP = {"пн": 0, "вт": 1, "ср": 2, "чт": 3, "пт": 4, "сб": 5, "вс": 6}
+
+REMIND_DAY_BEFORE = "day"
+REMIND_HOUR_BEFORE = "hour"
+REMINDER_OFFSETS = {
+    REMIND_DAY_BEFORE: timedelta(days=1),
+    REMIND_HOUR_BEFORE: timedelta(hours=1),
+}
+
+# На сколько вперёд планируются занятия
+PLAN_HORIZON = timedelta(days=8)
+# Даже без новых событий планировщик просыпается раз в час, чтобы продлить горизонт
+MAX_SLEEP = 3600
+
+ScheduleInfo = namedtuple("ScheduleInfo", ["days", "time", "timezone"])
+
+
+def parse_timezone(value):
+    """'UTC+6' / 'UTC-5' -> фиксированное смещение, иначе имя зоны из базы pytz."""
+    match = re.match(r"^UTC([+-])(\d+)$", value or "")
+    if match:
+        minutes = int(match.group(2)) * 60
+        return pytz.FixedOffset(minutes if match.group(1) == "+" else -minutes)
+    return pytz.timezone(value) if value else pytz.utc
+
+
+def parse_schedule(row):
+    """Разбирает строку таблицы schedule: дни недели, время и часовой пояс."""
+    if not row:
+        return None
+    days = {DAYS_MAP[day.strip().lower()] for day in row["days"].split(",")}
+    lesson_time = datetime.strptime(row["time"], "%H:%M").time()
+    return ScheduleInfo(days, lesson_time, parse_timezone(row["timezone"]))
+
+
+def lesson_instants(schedule, start, end):
+    """Моменты начала занятий (в UTC) в интервале [start, end)."""
+    tz = schedule.timezone
+    day = start.astimezone(tz).date()
+    last_day = end.astimezone(tz).date()
+    while day <= last_day:
+        if day.weekday() in schedule.days:
+            lesson_at = tz.localize(datetime.combine(day, schedule.time)).astimezone(pytz.utc)
+            if start <= lesson_at < end:
+                yield lesson_at
+        day += timedelta(days=1)
+
+
+class ReminderPlanner:
+    """
+    Очередь напоминаний с точным временем срабатывания (min-heap по времени).
+    Перестраивается только при изменении расписаний, каждый тик обрабатывает только наступившие события.
+    """
+
+    def __init__(self, horizon=PLAN_HORIZON):
+        self.horizon = horizon
+        self._schedules = {}
+        self._queue = []
+        self._planned_until = None
+        self._changed = asyncio.Event()
+
+    def rebuild(self, schedules, now=None):
+        """`schedules` — словарь {id курса: ScheduleInfo}."""
+        now = now or datetime.now(pytz.utc)
+        self._schedules = schedules
+        self._queue = []
+        self._planned_until = now
+        self._extend(now)
+        self._changed.set()
+
+    def _extend(self, now):
+        until = now + self.horizon
+        for schedule_id, schedule in self._schedules.items():
+            for lesson_at in lesson_instants(schedule, self._planned_until, until):
+                for kind, offset in REMINDER_OFFSETS.items():
+                    fire_at = lesson_at - offset
+                    if fire_at > now:
+                        heapq.heappush(self._queue, (fire_at, schedule_id, kind, lesson_at))
+        self._planned_until = until
+
+    def next_fire_at(self):
+        return self._queue[0][0] if self._queue else None
+
+    def pop_due(self, now):
+        """Возвращает наступившие события (fire_at, schedule_id, kind, lesson_at) и продлевает горизонт."""
+        due = []
+        while self._queue and self._queue[0][0] <= now:
+            due.append(heapq.heappop(self._queue))
+        self._extend(now)
+        return due
+
+    async def run(self, callback):
+        """Бесконечный цикл: спит до ближайшего события и вызывает `callback(schedule_id, kind, lesson_at)`."""
+        while True:
+            self._changed.clear()
+            for _, schedule_id, kind, lesson_at in self.pop_due(datetime.now(pytz.utc)):
+                try:
+                    await callback(schedule_id, kind, lesson_at)
+                except Exception as e:
+                    logging.error(f"Ошибка отправки напоминания ({schedule_id}, {kind}, {lesson_at}): {e}")
+
+            timeout = MAX_SLEEP
+            next_at = self.next_fire_at()
+            if next_at:
+                timeout = min(timeout, max(0.0, (next_at - datetime.now(pytz.utc)).total_seconds()))
+            try:
+                await asyncio.wait_for(self._changed.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
@@ -0,0 +1,330 @@
+import os
+
+import asyncpg
+
+import metrics
+
+# Настройки пула соединений. asyncpg подготавливает каждый запрос один раз на соединение
+# и кеширует его по тексту, поэтому все запросы ниже — константы с явным списком колонок.
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", "2"))
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", "10"))
+DB_COMMAND_TIMEOUT = float(os.getenv("DB_COMMAND_TIMEOUT", "30"))
+DB_STATEMENT_CACHE_SIZE = int(os.getenv("DB_STATEMENT_CACHE_SIZE", "100"))
+DB_MAX_INACTIVE_LIFETIME = float(os.getenv("DB_MAX_INACTIVE_LIFETIME", "300"))
+
+# Сколько дней хранить журнал отправленных напоминаний
+REMINDER_LEDGER_DAYS = int(os.getenv("REMINDER_LEDGER_DAYS", "30"))
+
+
+async def create_pool(dsn):
+    pool = await asyncpg.create_pool(
+        dsn,
+        min_size=DB_POOL_MIN_SIZE,
+        max_size=DB_POOL_MAX_SIZE,
+        command_timeout=DB_COMMAND_TIMEOUT,
+        statement_cache_size=DB_STATEMENT_CACHE_SIZE,
+        max_inactive_connection_lifetime=DB_MAX_INACTIVE_LIFETIME,
+        init=metrics.instrument_connection,
+    )
+    return metrics.InstrumentedPool(pool)
+
+
+# ---------------------------------------------------------------------------------------------------
+# Пользователи
+
+_USER_EXISTS = "SELECT 1 FROM users WHERE user_id = $1"
+_ALL_USER_IDS = "SELECT user_id FROM users"
+_INSERT_USER = """
+    INSERT INTO users (user_id, full_name, country, age, phone, timezone)
+    VALUES ($1, $2, $3, $4, $5, $6)
+"""
+_INSERT_USERS_IF_MISSING = """
+    INSERT INTO users (user_id, full_name, country, age, phone)
+    SELECT * FROM unnest($1::bigint[], $2::text[], $3::text[], $4::integer[], $5::text[])
+    ON CONFLICT (user_id) DO NOTHING
+    RETURNING user_id
+"""
+# Новые пользователи подписываются на первый (основной) курс
+_SUBSCRIBE_TO_DEFAULT = """
+    INSERT INTO subscriptions (user_id, schedule_id)
+    SELECT u.user_id, s.id FROM unnest($1::bigint[]) AS u (user_id), (SELECT id FROM schedule ORDER BY id LIMIT 1) s
+    ON CONFLICT DO NOTHING
+"""
+_DEACTIVATE_USERS = """
+    UPDATE users SET inactive_at = CURRENT_TIMESTAMP
+    WHERE user_id = ANY($1::bigint[]) AND inactive_at IS NULL
+"""
+_REACTIVATE_USER = "UPDATE users SET inactive_at = NULL WHERE user_id = $1 AND inactive_at IS NOT NULL"
+_INACTIVE_USERS_COUNT = "SELECT count(*) FROM users WHERE inactive_at IS NOT NULL"
+_INACTIVE_USER_IDS = "SELECT user_id FROM users WHERE inactive_at IS NOT NULL"
+_USERS_WITHOUT_TIMEZONE = "SELECT user_id, country FROM users WHERE timezone IS NULL OR timezone = 'UTC'"
+_UPDATE_TIMEZONES = """
+    UPDATE users SET timezone = t.timezone
+    FROM unnest($1::bigint[], $2::text[]) AS t (user_id, timezone)
+    WHERE users.user_id = t.user_id
+"""
+
+
+async def user_exists(pool, user_id):
+    async with pool.acquire() as conn:
+        return await conn.fetchval(_USER_EXISTS, user_id) is not None
+
+
+async def all_user_ids(pool):
+    async with pool.acquire() as conn:
+        return [row["user_id"] for row in await conn.fetch(_ALL_USER_IDS)]
+
+
+async def insert_user(pool, user_id, full_name, country, age, phone, timezone="UTC"):
+    async with pool.acquire() as conn:
+        async with conn.transaction():
+            await conn.execute(_INSERT_USER, user_id, full_name, country, age, phone, timezone)
+            await conn.execute(_SUBSCRIBE_TO_DEFAULT, [user_id])
+
+
+async def insert_users_if_missing(pool, users):
+    """users — последовательность кортежей (user_id, full_name, country, age, phone)."""
+    columns = [list(column) for column in zip(*users)] or [[]] * 5
+    async with pool.acquire() as conn:
+        async with conn.transaction():
+            # На основной курс подписываются только добавленные: существующие могли от него отписаться
+            inserted = await conn.fetch(_INSERT_USERS_IF_MISSING, *columns)
+            await conn.execute(_SUBSCRIBE_TO_DEFAULT, [row["user_id"] for row in inserted])
+
+
+async def deactivate_users(pool, user_ids):
+    """Помечает пользователей неактивными (заблокировали бота, удалили аккаунт)."""
+    async with pool.acquire() as conn:
+        await conn.execute(_DEACTIVATE_USERS, user_ids)
+
+
+async def reactivate_user(pool, user_id):
+    """Снимает пометку неактивности; возвращает True, если пользователь был неактивен."""
+    async with pool.acquire() as conn:
+        return await conn.execute(_REACTIVATE_USER, user_id) != "UPDATE 0"
+
+
+async def inactive_users_count(pool):
+    async with pool.acquire() as conn:
+        return await conn.fetchval(_INACTIVE_USERS_COUNT)
+
+
+async def inactive_user_ids(pool):
+    async with pool.acquire() as conn:
+        return [row["user_id"] for row in await conn.fetch(_INACTIVE_USER_IDS)]
+
+
+async def users_without_timezone(pool):
+    """Пользователи, у которых остался часовой пояс по умолчанию."""
+    async with pool.acquire() as conn:
+        return await conn.fetch(_USERS_WITHOUT_TIMEZONE)
+
+
+async def update_timezones(pool, user_ids, timezones):
+    """Массовое обновление часовых поясов одним запросом."""
+    async with pool.acquire() as conn:
+        await conn.execute(_UPDATE_TIMEZONES, user_ids, timezones)
+
+
+async def clear_users_and_schedule(pool):
+    async with pool.acquire() as conn:
+        async with conn.transaction():
+            await conn.execute("DELETE FROM users")
+            await conn.execute("DELETE FROM schedule")
+
+
+# ---------------------------------------------------------------------------------------------------
+# Расписание
+
+_GET_SCHEDULES = "SELECT id, name, text, days, time, timezone FROM schedule ORDER BY id"
+_UPDATE_SCHEDULE = "UPDATE schedule SET text = $1, days = $2, time = $3, timezone = $4 WHERE id = $5 RETURNING id"
+_INSERT_SCHEDULE = "INSERT INTO schedule (name, text, days, time, timezone) VALUES ($1, $2, $3, $4, $5) RETURNING id"
+
+_USER_SCHEDULE_IDS = "SELECT schedule_id FROM subscriptions WHERE user_id = $1"
+_SUBSCRIBER_IDS = """
+    SELECT s.user_id FROM subscriptions s JOIN users u ON u.user_id = s.user_id
+    WHERE s.schedule_id = $1 AND u.inactive_at IS NULL
+"""
+# Записывает в журнал напоминание для всех подписчиков курса и возвращает только тех,
+# кому оно ещё не отправлялось (другим инстансом или до перезапуска)
+_CLAIM_REMINDER_RECIPIENTS = """
+    WITH claimed AS (
+        INSERT INTO reminder_deliveries (user_id, lesson_at, kind)
+        SELECT s.user_id, $2, $3 FROM subscriptions s JOIN users u ON u.user_id = s.user_id
+        WHERE s.schedule_id = $1 AND u.inactive_at IS NULL
+        ON CONFLICT (user_id, lesson_at, kind) DO NOTHING
+        RETURNING user_id
+    )
+    SELECT u.timezone, array_agg(u.user_id) AS user_ids
+    FROM claimed c JOIN users u ON u.user_id = c.user_id
+    GROUP BY u.timezone
+"""
+_CLEANUP_REMINDER_DELIVERIES = "DELETE FROM reminder_deliveries WHERE lesson_at < CURRENT_TIMESTAMP - make_interval(days => $1)"
+_SUBSCRIBE = "INSERT INTO subscriptions (user_id, schedule_id) VALUES ($1, $2) ON CONFLICT DO NOTHING"
+_UNSUBSCRIBE = "DELETE FROM subscriptions WHERE user_id = $1 AND schedule_id = $2"
+
+
+async def get_schedules(pool):
+    async with pool.acquire() as conn:
+        return await conn.fetch(_GET_SCHEDULES)
+
+
+async def save_schedule(pool, schedule_id, name, text, days, time, timezone):
+    """Обновляет расписание курса schedule_id или создаёт новый курс с именем name. Возвращает id курса."""
+    async with pool.acquire() as conn:
+        if schedule_id:
+            return await conn.fetchval(_UPDATE_SCHEDULE, text, days, time, timezone, schedule_id)
+        return await conn.fetchval(_INSERT_SCHEDULE, name, text, days, time, timezone)
+
+
+async def user_schedule_ids(pool, user_id):
+    async with pool.acquire() as conn:
+        return {row["schedule_id"] for row in await conn.fetch(_USER_SCHEDULE_IDS, user_id)}
+
+
+async def subscriber_ids(pool, schedule_id):
+    async with pool.acquire() as conn:
+        return [row["user_id"] for row in await conn.fetch(_SUBSCRIBER_IDS, schedule_id)]
+
+
+async def claim_reminder_recipients(pool, schedule_id, lesson_at, kind):
+    """
+    Подписчики курса, которым ещё не отправлялось напоминание (lesson_at, kind), сгруппированные
+    по часовому поясу: [(timezone, [user_id, ...]), ...]. Возвращённые пользователи сразу отмечаются в журнале.
+    """
+    async with pool.acquire() as conn:
+        rows = await conn.fetch(_CLAIM_REMINDER_RECIPIENTS, schedule_id, lesson_at, kind)
+    return [(row["timezone"], row["user_ids"]) for row in rows]
+
+
+async def cleanup_reminder_deliveries(pool, keep_days=REMINDER_LEDGER_DAYS):
+    """Удаляет из журнала напоминания о давно прошедших занятиях."""
+    async with pool.acquire() as conn:
+        await conn.execute(_CLEANUP_REMINDER_DELIVERIES, keep_days)
+
+
+async def set_subscription(pool, user_id, schedule_id, subscribed):
+    async with pool.acquire() as conn:
+        await conn.execute(_SUBSCRIBE if subscribed else _UNSUBSCRIBE, user_id, schedule_id)
+
+
+async def notify(pool, channel, payload=""):
+    async with pool.acquire() as conn:
+        await conn.execute("SELECT pg_notify($1, $2)", channel, payload)
+
+
+# ---------------------------------------------------------------------------------------------------
+# Рассылки
+
+_CREATE_JOB = """
+    INSERT INTO broadcast_jobs (admin_chat_id, source_chat_id, message_ids, local_time, owner, heartbeat_at)
+    VALUES ($1, $2, $3, $4, $5, CURRENT_TIMESTAMP)
+    RETURNING id
+"""
+_GET_JOB = """
+    SELECT id, admin_chat_id, source_chat_id, message_ids, status
+    FROM broadcast_jobs WHERE id = $1
+"""
+# Забирает незавершённые рассылки без живого владельца. Конкурирующий UPDATE другого инстанса
+# перепроверяет условие на уже обновлённой строке, поэтому каждую рассылку получает только один инстанс
+_CLAIM_STALE_JOBS = """
+    UPDATE broadcast_jobs SET owner = $1, heartbeat_at = CURRENT_TIMESTAMP
+    WHERE status = 'running'
+      AND (owner IS NULL OR heartbeat_at IS NULL OR heartbeat_at < CURRENT_TIMESTAMP - make_interval(secs => $2))
+    RETURNING id, admin_chat_id, local_time, scheduled_at
+"""
+_RENEW_JOB_LEASES = "UPDATE broadcast_jobs SET heartbeat_at = CURRENT_TIMESTAMP WHERE owner = $1 AND status = 'running'"
+# $2 — часовые пояса одной волны рассылки по местному времени; NULL — все получатели
+_PENDING_RECIPIENTS = """
+    SELECT u.user_id FROM users u
+    WHERE u.inactive_at IS NULL
+      AND ($2::text[] IS NULL OR COALESCE(u.timezone, 'UTC') = ANY($2::text[]))
+      AND NOT EXISTS (
+        SELECT 1 FROM broadcast_deliveries d WHERE d.job_id = $1 AND d.user_id = u.user_id
+      )
+    ORDER BY u.user_id
+"""
+_ACTIVE_TIMEZONES = "SELECT DISTINCT COALESCE(timezone, 'UTC') AS timezone FROM users WHERE inactive_at IS NULL"
+_RECORD_DELIVERIES = """
+    INSERT INTO broadcast_deliveries (job_id, user_id, status)
+    SELECT $1, d.user_id, d.status FROM unnest($2::bigint[], $3::text[]) AS d (user_id, status)
+    ON CONFLICT (job_id, user_id) DO NOTHING
+"""
+_FINISH_JOB = "UPDATE broadcast_jobs SET status = 'done', finished_at = CURRENT_TIMESTAMP WHERE id = $1"
+_JOB_DELIVERY_COUNTS = "SELECT status, count(*) AS count FROM broadcast_deliveries WHERE job_id = $1 GROUP BY status"
+
+
+async def create_job(pool, admin_chat_id, source_chat_id, message_ids, local_time=None, owner=None):
+    async with pool.acquire() as conn:
+        return await conn.fetchval(_CREATE_JOB, admin_chat_id, source_chat_id, message_ids, local_time, owner)
+
+
+async def get_job(pool, job_id):
+    async with pool.acquire() as conn:
+        return await conn.fetchrow(_GET_JOB, job_id)
+
+
+async def claim_stale_jobs(pool, owner, lease_seconds):
+    """Переводит на owner рассылки, аренда которых истекла; возвращает их."""
+    async with pool.acquire() as conn:
+        rows = await conn.fetch(_CLAIM_STALE_JOBS, owner, lease_seconds)
+    return sorted(rows, key=lambda row: row["id"])
+
+
+async def renew_job_leases(pool, owner):
+    async with pool.acquire() as conn:
+        await conn.execute(_RENEW_JOB_LEASES, owner)
+
+
+async def pending_recipients(pool, job_id, timezones=None):
+    """Получатели рассылки (при указании timezones — только из этих поясов), которым ещё ничего не отправлялось."""
+    async with pool.acquire() as conn:
+        return [row["user_id"] for row in await conn.fetch(_PENDING_RECIPIENTS, job_id, timezones)]
+
+
+async def active_timezones(pool):
+    async with pool.acquire() as conn:
+        return [row["timezone"] for row in await conn.fetch(_ACTIVE_TIMEZONES)]
+
+
+async def record_deliveries(pool, job_id, user_ids, statuses):
+    async with pool.acquire() as conn:
+        await conn.execute(_RECORD_DELIVERIES, job_id, user_ids, statuses)
+
+
+async def finish_job(pool, job_id):
+    async with pool.acquire() as conn:
+        await conn.execute(_FINISH_JOB, job_id)
+
+
+async def job_delivery_counts(pool, job_id):
+    """Число получателей рассылки по статусам: {status: count}."""
+    async with pool.acquire() as conn:
+        return {row["status"]: row["count"] for row in await conn.fetch(_JOB_DELIVERY_COUNTS, job_id)}
+
+
+# ---------------------------------------------------------------------------------------------------
+# Поиск
+
+_SEARCH_USERS = """
+    SELECT user_id, full_name, country, age, phone, score FROM (
+        SELECT user_id, full_name, country, age, phone,
+               GREATEST(similarity(LOWER(full_name), $1), similarity(LOWER(country), $1)) AS score
+        FROM users
+        WHERE LOWER(full_name) LIKE '%' || $2 || '%'
+           OR LOWER(country) LIKE '%' || $2 || '%'
+           OR LOWER(full_name) % $1
+    ) found
+    WHERE $3::real IS NULL OR (score, user_id) {op} ($3::real, $4::bigint)
+    ORDER BY score {order}, user_id {order}
+    LIMIT $5
+"""
+_SEARCH_USERS_FORWARD = _SEARCH_USERS.format(op="<", order="DESC")
+_SEARCH_USERS_BACKWARD = _SEARCH_USERS.format(op=">", order="ASC")
+
+
+async def search_users(pool, query, like_pattern, score, user_id, limit, backward=False):
+    """Страница поиска по ключу (score, user_id); при backward=True строки идут в обратном порядке."""
+    sql = _SEARCH_USERS_BACKWARD if backward else _SEARCH_USERS_FORWARD
+    async with pool.acquire() as conn:
+        return await conn.fetch(sql, query, like_pattern, score, user_id, limit)
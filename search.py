@@ -0,0 +1,62 @@
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+
+import repository
+
+PAGE_SIZE = 10
+# Поля пользователя обрезаются, чтобы страница гарантированно помещалась в одно сообщение
+FIELD_LIMIT = 100
+
+
+def _escape_like(value):
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+async def search_users(pool, query, cursor=None, direction="next", limit=PAGE_SIZE):
+    """
+    Ищет пользователей по имени или стране (индексы pg_trgm), сортируя по похожести.
+    Пагинация по ключу (score, user_id): `cursor` — последняя (для next) или первая (для prev)
+    строка текущей страницы. Возвращает (строки страницы, есть ли ещё страница в этом направлении).
+    """
+    query = query.lower()
+    score, user_id = cursor if cursor else (None, None)
+    rows = await repository.search_users(pool, query, _escape_like(query), score, user_id, limit + 1,
+                                         backward=direction == "prev")
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if direction == "prev":
+        rows.reverse()
+    return rows, has_more
+
+
+def _cut(value):
+    value = str(value)
+    return value if len(value) <= FIELD_LIMIT else value[:FIELD_LIMIT] + "…"
+
+
+def format_results(rows):
+    response = "📋 Результаты поиска:\n"
+    for user in rows:
+        response += (f"👤 {_cut(user['full_name'])}, 🏙 {_cut(user['country'])}, {user['age']} возраст\n"
+                     f"📞 {_cut(user['phone'])}\n\n")
+    return response
+
+
+def results_keyboard(rows, has_prev, has_next):
+    """Кнопки «назад/вперёд»; в callback_data хранится ключ первой или последней строки страницы."""
+    buttons = []
+    if has_prev:
+        first = rows[0]
+        buttons.append(InlineKeyboardButton(text="⬅️ Назад",
+                                            callback_data=f"search:prev:{first['score']!r}:{first['user_id']}"))
+    if has_next:
+        last = rows[-1]
+        buttons.append(InlineKeyboardButton(text="Вперёд ➡️",
+                                            callback_data=f"search:next:{last['score']!r}:{last['user_id']}"))
+    return InlineKeyboardMarkup(inline_keyboard=[buttons]) if buttons else None
+
+
+def parse_callback(data):
+    """'search:next:0.42:123' -> ('next', (0.42, 123))"""
+    _, direction, score, user_id = data.split(":")
+    return direction, (float(score), int(user_id))
@@ -0,0 +1,105 @@
+import os
+import time
+from collections import OrderedDict
+
+from aiogram import BaseMiddleware
+
+from metrics import THROTTLED_UPDATES
+
+# Сколько обновлений в секунду и с каким запасом принимаем от одного пользователя
+THROTTLE_RATE = float(os.getenv("THROTTLE_RATE", "1"))
+THROTTLE_BURST = float(os.getenv("THROTTLE_BURST", "5"))
+# Одинаковый текст или одна и та же кнопка чаще этого интервала отбрасывается
+THROTTLE_DEBOUNCE = float(os.getenv("THROTTLE_DEBOUNCE", "2"))
+THROTTLE_MAX_USERS = int(os.getenv("THROTTLE_MAX_USERS", "10000"))
+
+
+class _UserState:
+    __slots__ = ("tokens", "updated", "last_text", "last_at")
+
+    def __init__(self, tokens, now):
+        self.tokens = tokens
+        self.updated = now
+        self.last_text = None
+        self.last_at = 0.0
+
+
+class ThrottlingMiddleware(BaseMiddleware):
+    """
+    Внешний middleware обновлений: token bucket на пользователя и отброс повторов одинакового текста
+    в сообщениях и нажатиях кнопок. Должен стоять перед FSM middleware (см. register_before_fsm),
+    тогда отброшенные обновления не читают состояние из БД и не доходят до хендлеров.
+    """
+
+    def __init__(self, rate=THROTTLE_RATE, burst=THROTTLE_BURST, debounce=THROTTLE_DEBOUNCE,
+                 max_users=THROTTLE_MAX_USERS, exempt=()):
+        self.rate = rate
+        self.burst = burst
+        self.debounce = debounce
+        self.max_users = max_users
+        self.exempt = set(exempt)
+        self._users = OrderedDict()
+
+    def _state(self, user_id, now):
+        state = self._users.get(user_id)
+        if state is None:
+            state = self._users[user_id] = _UserState(self.burst, now)
+            while len(self._users) > self.max_users:
+                self._users.popitem(last=False)
+        else:
+            self._users.move_to_end(user_id)
+        return state
+
+    def _check(self, user_id, text):
+        """Возвращает причину отброса или None, если обновление можно обработать."""
+        now = time.monotonic()
+        state = self._state(user_id, now)
+
+        if text is not None and text == state.last_text and now - state.last_at < self.debounce:
+            return "debounce"
+
+        state.tokens = min(self.burst, state.tokens + (now - state.updated) * self.rate)
+        state.updated = now
+        if state.tokens < 1:
+            return "rate"
+
+        state.tokens -= 1
+        state.last_text, state.last_at = text, now
+        return None
+
+    async def __call__(self, handler, event, data):
+        user = data.get("event_from_user")
+        if user is None or user.id in self.exempt:
+            return await handler(event, data)
+
+        if event.message:
+            text = event.message.text
+        elif event.callback_query:
+            text = event.callback_query.data
+        else:
+            return await handler(event, data)
+
+        reason = self._check(user.id, text)
+        if reason is None:
+            return await handler(event, data)
+
+        THROTTLED_UPDATES.inc(reason)
+        if event.callback_query:
+            # Иначе у пользователя будут «крутиться часики» на кнопке
+            await event.callback_query.answer()
+        return None
+
+
+def register_before_fsm(dp, middleware):
+    """
+    Ставит middleware в цепочку dp.update.outer_middleware перед FSMContextMiddleware:
+    тот сразу читает состояние из хранилища, то есть делает запрос в Postgres на каждое обновление.
+    Пользователь (event_from_user) к этому моменту уже определён UserContextMiddleware.
+    """
+    outer = dp.update.outer_middleware
+    following = list(outer)[list(outer).index(dp.fsm):]
+    for item in following:
+        outer.unregister(item)
+    outer.register(middleware)
+    for item in following:
+        outer.register(item)
@@ -0,0 +1,63 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+# Страна или крупный город (как пользователи пишут при регистрации) -> часовой пояс
+COUNTRY_TIMEZONES = {
+    "казахстан": "Asia/Almaty", "kazakhstan": "Asia/Almaty", "кз": "Asia/Almaty",
+    "алматы": "Asia/Almaty", "астана": "Asia/Almaty", "шымкент": "Asia/Almaty", "караганда": "Asia/Almaty",
+    "актобе": "Asia/Aqtobe", "атырау": "Asia/Atyrau", "актау": "Asia/Aqtau", "уральск": "Asia/Oral",
+    "кыргызстан": "Asia/Bishkek", "киргизия": "Asia/Bishkek", "kyrgyzstan": "Asia/Bishkek",
+    "бишкек": "Asia/Bishkek", "ош": "Asia/Bishkek",
+    "узбекистан": "Asia/Tashkent", "uzbekistan": "Asia/Tashkent", "ташкент": "Asia/Tashkent",
+    "самарканд": "Asia/Samarkand",
+    "таджикистан": "Asia/Dushanbe", "tajikistan": "Asia/Dushanbe", "душанбе": "Asia/Dushanbe",
+    "туркменистан": "Asia/Ashgabat", "turkmenistan": "Asia/Ashgabat", "ашхабад": "Asia/Ashgabat",
+    "монголия": "Asia/Ulaanbaatar", "mongolia": "Asia/Ulaanbaatar",
+    "россия": "Europe/Moscow", "рф": "Europe/Moscow", "russia": "Europe/Moscow",
+    "москва": "Europe/Moscow", "санкт-петербург": "Europe/Moscow", "казань": "Europe/Moscow",
+    "екатеринбург": "Asia/Yekaterinburg", "новосибирск": "Asia/Novosibirsk", "омск": "Asia/Omsk",
+    "красноярск": "Asia/Krasnoyarsk", "иркутск": "Asia/Irkutsk", "владивосток": "Asia/Vladivostok",
+    "украина": "Europe/Kyiv", "ukraine": "Europe/Kyiv", "киев": "Europe/Kyiv",
+    "беларусь": "Europe/Minsk", "belarus": "Europe/Minsk", "минск": "Europe/Minsk",
+    "молдова": "Europe/Chisinau", "moldova": "Europe/Chisinau",
+    "азербайджан": "Asia/Baku", "azerbaijan": "Asia/Baku", "баку": "Asia/Baku",
+    "армения": "Asia/Yerevan", "armenia": "Asia/Yerevan", "ереван": "Asia/Yerevan",
+    "грузия": "Asia/Tbilisi", "georgia": "Asia/Tbilisi", "тбилиси": "Asia/Tbilisi",
+    "турция": "Europe/Istanbul", "turkey": "Europe/Istanbul",
+    "германия": "Europe/Berlin", "germany": "Europe/Berlin",
+    "польша": "Europe/Warsaw", "poland": "Europe/Warsaw",
+    "южная корея": "Asia/Seoul", "корея": "Asia/Seoul", "korea": "Asia/Seoul",
+    "оаэ": "Asia/Dubai", "uae": "Asia/Dubai",
+}
+
+# Координаты округляются до ~1 км: соседние точки попадают в один и тот же ключ кеша
+COORDINATE_PRECISION = 2
+
+# TimezoneFinder тяжёлый (numpy + данные полигонов) и не рассчитан на параллельные вызовы,
+# поэтому он создаётся лениво и работает в одном отдельном потоке
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="timezonefinder")
+_finder = None
+
+
+def timezone_for_country(country):
+    """Часовой пояс по названию страны или города; None, если не знаем."""
+    return COUNTRY_TIMEZONES.get((country or "").strip().lower().replace("ё", "е"))
+
+
+@lru_cache(maxsize=4096)
+def _timezone_at(lat, lng):
+    global _finder
+    if _finder is None:
+        from timezonefinder import TimezoneFinder
+
+        _finder = TimezoneFinder()
+    return _finder.timezone_at(lat=lat, lng=lng)
+
+
+async def timezone_for_location(latitude, longitude):
+    """Часовой пояс по геопозиции; поиск выполняется вне event loop и кешируется."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        _executor, _timezone_at, round(latitude, COORDINATE_PRECISION), round(longitude, COORDINATE_PRECISION)
+    )
@@ -0,0 +1,79 @@
+import asyncio
+import logging
+import os
+
+from aiohttp import web
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+
+import metrics
+
+# Если WEBHOOK_URL задан, бот принимает обновления через webhook вместо long polling
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+WEBAPP_HOST = os.getenv("WEBAPP_HOST", "0.0.0.0")
+WEBAPP_PORT = int(os.getenv("PORT", "8080"))  # Heroku передаёт порт в $PORT
+
+# На Heroku HTTP-трафик и $PORT получают только dyno типа web (см. Procfile): в режиме webhook
+# масштабируйте web=1 worker=0, в режиме long polling — worker=1 web=0
+DYNO = os.getenv("DYNO", "")
+
+
+def polling_on_web_dyno():
+    """
+    Без WEBHOOK_URL бот работает через long polling и не слушает $PORT: на dyno типа web
+    Heroku убьёт его по таймауту загрузки, а рядом с worker он будет вторым потребителем getUpdates.
+    """
+    return not WEBHOOK_URL and DYNO.startswith("web")
+
+
+async def health(request):
+    return web.json_response({"status": "ok"})
+
+
+async def run_webhook(dp, bot, db_pool=None):
+    """
+    Поднимает aiohttp-сервер для webhook. Каждое обновление обрабатывается в отдельной задаче,
+    а Telegram сразу получает 200, поэтому несколько таких воркеров можно держать за балансировщиком.
+    """
+    if not WEBHOOK_SECRET:
+        logging.warning("WEBHOOK_SECRET не задан: запросы к webhook не проверяются")
+    if DYNO.startswith("worker"):
+        logging.warning("Webhook запущен на dyno типа worker: Heroku не направит на него HTTP-запросы, "
+                        "запустите процесс web (heroku ps:scale web=1 worker=0)")
+
+    app = web.Application()
+    SimpleRequestHandler(
+        dispatcher=dp,
+        bot=bot,
+        secret_token=WEBHOOK_SECRET,
+        handle_in_background=True,
+    ).register(app, path=WEBHOOK_PATH)
+    app.router.add_get("/health", health)
+    metrics_runner = None
+    if metrics.METRICS_PORT:
+        metrics_runner = await metrics.start_server(db_pool, WEBAPP_HOST, int(metrics.METRICS_PORT))
+    elif metrics.METRICS_TOKEN:
+        metrics.setup_routes(app, db_pool)
+    else:
+        # Сервер webhook доступен из интернета: без токена метрики (тексты SQL, ошибки) видел бы кто угодно
+        logging.warning("METRICS_TOKEN и METRICS_PORT не заданы: /metrics в режиме webhook отключён")
+    setup_application(app, dp, bot=bot)
+
+    await bot.set_webhook(
+        WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH,
+        secret_token=WEBHOOK_SECRET,
+        allowed_updates=dp.resolve_used_update_types(),
+    )
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, WEBAPP_HOST, WEBAPP_PORT).start()
+    logging.info(f"Webhook слушает {WEBAPP_HOST}:{WEBAPP_PORT}{WEBHOOK_PATH}")
+
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()